@@ -0,0 +1,195 @@
+'''
+BatchAnalysis: searches every position of an EPD file with the SmartMoveFinder search.
+The file is read one line at a time and each result is written as soon as it (and every line before it)
+is done, so files of any size are analysed in constant memory and results come out in input order.
+
+python BatchAnalysis.py positions.epd                         depth 4 search of every position, EPD to stdout
+python BatchAnalysis.py positions.epd -o results.epd          write to a file instead
+python BatchAnalysis.py positions.epd --workers 4             spread positions over 4 processes
+python BatchAnalysis.py positions.epd --time 1.0              one second per position instead of a fixed depth
+python BatchAnalysis.py positions.epd --json                  one JSON object per line
+
+Each output line is the input position with its operations, plus the analysis operations:
+acd (depth), acn (nodes), acs (seconds), ce (centipawns for the side to move), dm (mate in moves, when
+found), pm (best move) and pv (principal variation), moves in SAN. The JSON output also has the moves
+in coordinate notation (e2e4, e7e8q).
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import collections
+import json
+import multiprocessing
+import sys
+import ChessEngine
+import SmartMoveFinder
+
+###########################################
+# EPD
+###########################################
+
+ANALYSIS_OPCODES = ("acd", "acn", "acs", "ce", "dm", "pm", "pv") # replaced on output if the input already has them
+
+# Split an EPD line into its FEN and its operations [(opcode, operands)]. The counters come from
+# the hmvc and fmvn operations when present. Operands keep their quotes, semicolons inside quotes are allowed.
+def parseEPD(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD needs board, side to move, castling and enpassant fields: " + line.strip())
+    operations = []
+    text = fields[4] if len(fields) > 4 else ""
+    start = 0
+    inQuotes = False
+    for i in range(len(text)):
+        if text[i] == '"':
+            inQuotes = not inQuotes
+        elif text[i] == ";" and not inQuotes:
+            operation = text[start:i].strip().split(None, 1)
+            if operation:
+                operations.append((operation[0], operation[1] if len(operation) > 1 else ""))
+            start = i + 1
+    if text[start:].strip():
+        raise ValueError("EPD operation is missing its ';': " + line.strip())
+    values = dict(operations)
+    fen = "%s %s %s %s %s %s" % (fields[0], fields[1], fields[2], fields[3],
+                                 values.get("hmvc", "0"), values.get("fmvn", "1"))
+    return fen, operations
+
+def formatEPD(fen, operations):
+    return " ".join(fen.split()[:4] + ["%s %s;" % (opcode, operands) if operands else opcode + ";"
+                                       for opcode, operands in operations])
+
+###########################################
+# Analysis
+###########################################
+
+analysisSearcher = None # one Searcher per process, set up by initAnalysisWorker
+
+def initAnalysisWorker(depth, timeLimit, ttSizeMB):
+    global analysisSearcher
+    analysisSearcher = SmartMoveFinder.Searcher(depth, timeLimit, ttSizeMB)
+
+# Search the position of one EPD line, returns a result dict (with "error" set when the line can't be used)
+def analyseLine(task):
+    lineNumber, line = task
+    try:
+        fen, operations = parseEPD(line)
+        gs = ChessEngine.Game(fen=fen)
+    except (ValueError, KeyError, IndexError) as error:
+        return {"line": lineNumber, "error": "%s: %s" % (type(error).__name__, error)}
+    searcher = analysisSearcher
+    searcher.tt.clear() # every position starts fresh, so results don't depend on which worker got them
+    searcher.history.clear()
+    validMoves = gs.getValidMoves()
+    result = {"line": lineNumber, "fen": fen, "operations": operations}
+    if len(validMoves) == 0:
+        result.update({"bestMove": None, "bestMoveSAN": None,
+                       "score": -SmartMoveFinder.CHECKMATE if gs.checkmate else SmartMoveFinder.STALEMATE,
+                       "depth": 0, "nodes": 0, "seconds": 0.0, "pv": [], "pvSAN": []})
+        return result
+    try:
+        searchResult = searcher.search(gs, validMoves)
+        pvSAN = []
+        for move in searchResult.pv: # SAN depends on the position, so the line is played out to write it
+            pvSAN.append(gs.getSAN(move))
+            gs.makeMove(move)
+    except Exception as error: # one position the engine can't handle mustn't stop the rest of the batch
+        return {"line": lineNumber, "error": "%s: %s" % (type(error).__name__, error)}
+    result.update({"bestMove": searchResult.bestMove.getChessNotation(), "bestMoveSAN": pvSAN[0],
+                   "score": searchResult.score, "depth": searchResult.depth, "nodes": searchResult.nodes,
+                   "seconds": round(searchResult.elapsed, 3),
+                   "pv": [move.getChessNotation() for move in searchResult.pv], "pvSAN": pvSAN})
+    return result
+
+def analysisOperations(result):
+    score = result["score"]
+    operations = [operation for operation in result["operations"] if operation[0] not in ANALYSIS_OPCODES]
+    operations += [("acd", str(result["depth"])), ("acn", str(result["nodes"])), ("acs", str(result["seconds"]))]
+    if abs(score) >= SmartMoveFinder.MATE_BOUND:
+        plies = SmartMoveFinder.CHECKMATE - abs(score)
+        operations.append(("ce", str(32767 - plies if score > 0 else plies - 32767)))
+        operations.append(("dm", str((plies + 1) // 2 if score > 0 else -(plies // 2))))
+    else:
+        operations.append(("ce", str(int(round(score * 100)))))
+    if result["bestMove"] is not None:
+        operations.append(("pm", result["bestMoveSAN"]))
+        operations.append(("pv", " ".join(result["pvSAN"])))
+    return operations
+
+# Numbered non-blank lines of the file, read lazily
+def readPositions(inputFile):
+    for lineNumber, line in enumerate(inputFile, 1):
+        if line.strip() and not line.startswith("#"):
+            yield lineNumber, line
+
+# Analyse every position from inputFile and write one line per position to outputFile, in input order.
+# At most window positions are in flight at once, so memory stays flat however long the file is.
+# Returns (positions analysed, lines skipped as invalid).
+def analyseFile(inputFile, outputFile, depth, timeLimit, workers, asJson=False, ttSizeMB=SmartMoveFinder.TT_SIZE_MB):
+    counts = [0, 0]
+    def write(result):
+        if "error" in result:
+            counts[1] += 1
+            print("line %d skipped, %s" % (result["line"], result["error"]), file=sys.stderr)
+            return
+        counts[0] += 1
+        if asJson:
+            record = dict(result)
+            record["operations"] = analysisOperations(result)
+            outputFile.write(json.dumps(record) + "\n")
+        else:
+            outputFile.write(formatEPD(result["fen"], analysisOperations(result)) + "\n")
+        outputFile.flush()
+
+    if workers <= 1:
+        initAnalysisWorker(depth, timeLimit, ttSizeMB)
+        for task in readPositions(inputFile):
+            write(analyseLine(task))
+        return counts[0], counts[1]
+    window = workers * 4
+    pool = multiprocessing.Pool(workers, initializer=initAnalysisWorker, initargs=(depth, timeLimit, ttSizeMB))
+    try:
+        pending = collections.deque()
+        for task in readPositions(inputFile):
+            pending.append(pool.apply_async(analyseLine, (task,)))
+            if len(pending) >= window:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+    return counts[0], counts[1]
+
+###########################################
+# Command Line
+###########################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search every position of an EPD file")
+    parser.add_argument("epd", help="EPD file to analyse, - for stdin")
+    parser.add_argument("-o", "--output", help="write results here instead of stdout")
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.DEPTH, help="deepest iteration per position")
+    parser.add_argument("--time", type=float, help="seconds per position, the search stops at --depth or this, whichever comes first")
+    parser.add_argument("--workers", type=int, default=1, help="processes searching positions in parallel")
+    parser.add_argument("--tt-size", type=float, default=SmartMoveFinder.TT_SIZE_MB, help="transposition table MB per worker")
+    parser.add_argument("--json", action="store_true", help="one JSON object per line instead of EPD")
+    args = parser.parse_args(argv)
+
+    inputFile = sys.stdin if args.epd == "-" else open(args.epd)
+    outputFile = open(args.output, "w") if args.output else sys.stdout
+    try:
+        analysed, skipped = analyseFile(inputFile, outputFile, args.depth, args.time, args.workers, args.json, args.tt_size)
+    finally:
+        if inputFile is not sys.stdin:
+            inputFile.close()
+        if outputFile is not sys.stdout:
+            outputFile.close()
+    print("%d positions analysed, %d skipped" % (analysed, skipped), file=sys.stderr)
+    return 1 if skipped else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
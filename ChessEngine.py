@@ -4,12 +4,21 @@
  It will also keep a move log
 '''
 
+import random
+import re
+import time
+
 ###########################################
 # Game Engine
 ###########################################
 
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+DEBUG_ZOBRIST = False # recompute the zobrist key from scratch after every move and assert it matches
+DEBUG_EVALUATION = False # recompute the incremental evaluation from scratch after every move and assert it matches
+DEBUG_PIECE_SQUARES = False # rebuild the piece square sets from the board after every move and assert they match
+
 class Game():
-    def __init__(self):
+    def __init__(self, fen=None):
         # board is an 8x8 2d list, each element of the list has 2 characters.
         # The first character represents the color of the piece, 'b' or 'w'
         # "--" represents an empty space with no piece.
@@ -23,6 +32,7 @@ class Game():
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
+        self.pieceSquares = self.computePieceSquares() # {piece: set of sq}, kept up to date by makeMove/undoMove
         self.moveFunctions = {"p":self.getPawnMoves, "R":self.getRookMoves, "K":self.getKingMoves, 
                               "Q":self.getQueenMoves, "N":self.getKnightMoves, "B":self.getBishopMoves}
         self.whiteToMove = True
@@ -33,49 +43,265 @@ class Game():
         self.stalemate = False
         self.enpassantPossible = () # coordinates for the square where an enpassant capture is possible
         self.currentCastlingRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs,
-                                             self.currentCastlingRights.bks, self.currentCastlingRights.bqs)]
+        self.halfmoveClock = 0 # plies since the last capture or pawn move, for the fifty move rule
+        self.fullmoveNumber = 1 # starts at 1 and goes up after each black move
+        self.zobristKey = self.computeZobristKey() # 64-bit position hash, kept up to date by makeMove/undoMove
+        # Running evaluation in centipawns from white's point of view, middlegame and endgame halves
+        # of material plus piece-square bonuses, blended by phase (remaining non-pawn material)
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+        self.stateLog = [] # one entry per move played, what undoMove restores (see makeMove)
+        if fen is not None:
+            self.loadFEN(fen)
+
+    # Set up the position from a FEN string: piece placement, side to move, castling rights, enpassant square
+    # and the halfmove clock and fullmove number. Missing fields take their start position values, so the
+    # first four fields of an EPD line load the same way.
+    def loadFEN(self, fen):
+        fields = fen.split()
+        rows = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char.upper() in "PNBRQK":
+                    row.append(("w" if char.isupper() else "b") + ("p" if char.upper() == "P" else char.upper()))
+                else:
+                    raise ValueError("invalid piece '%s' in FEN: %s" % (char, fen))
+            rows.append(row)
+        if len(rows) != 8 or any(len(row) != 8 for row in rows):
+            raise ValueError("FEN board is not 8x8: " + fen)
+        if sum(row.count("wK") for row in rows) != 1 or sum(row.count("bK") for row in rows) != 1:
+            raise ValueError("FEN needs one king of each color: " + fen)
+        if "wp" in rows[0] + rows[7] or "bp" in rows[0] + rows[7]:
+            raise ValueError("FEN has a pawn on the first or last rank: " + fen)
+        self.board = rows
+        self.pieceSquares = self.computePieceSquares()
+        self.whiteToMove = len(fields) < 2 or fields[1] == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        # rights whose king or rook has left its home square can't be used, so they are dropped
+        whiteKing, blackKing = rows[7][4] == "wK", rows[0][4] == "bK"
+        self.currentCastlingRights = CastleRights("K" in castling and whiteKing and rows[7][7] == "wR",
+                                                  "Q" in castling and whiteKing and rows[7][0] == "wR",
+                                                  "k" in castling and blackKing and rows[0][7] == "bR",
+                                                  "q" in castling and blackKing and rows[0][0] == "bR")
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        if enpassant == "-":
+            self.enpassantPossible = ()
+        else:
+            # the square behind a pawn of the side that just moved, which it passed with a double step
+            if self.whiteToMove:
+                rank, pawnRow, pawn = "6", 3, "bp"
+            else:
+                rank, pawnRow, pawn = "3", 4, "wp"
+            if len(enpassant) != 2 or enpassant[0] not in Move.filesToCols or enpassant[1] != rank \
+                    or rows[pawnRow][Move.filesToCols[enpassant[0]]] != pawn:
+                raise ValueError("invalid en passant square '%s' in FEN: %s" % (enpassant, fen))
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        for row in range(8):
+            for col in range(8):
+                if rows[row][col] == "wK":
+                    self.whiteKingLocation = (row, col)
+                elif rows[row][col] == "bK":
+                    self.blackKingLocation = (row, col)
+        self.moveLog = []
+        self.checkmate = False
+        self.stalemate = False
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.zobristKey = self.computeZobristKey()
+        self.mgScore, self.egScore, self.phase = self.computeEvaluation()
+        self.stateLog = []
+
+    # FEN string of the current position, the inverse of loadFEN
+    def getFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ""))
+        rights = self.currentCastlingRights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]] if self.enpassantPossible else "-"
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", enpassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
+
+    # Standard algebraic notation of a legal move in the current position, e.g. "Nbd7", "exd6", "e8=Q+", "O-O#"
+    def getSAN(self, move):
+        if move.isCastleMove:
+            san = "O-O" if move.endCol > move.startCol else "O-O-O"
+        else:
+            pieceType = move.pieceMoved[1]
+            capture = "x" if move.pieceCaptured != "--" else ""
+            destination = move.getRankFile(move.endRow, move.endCol)
+            if pieceType == "p":
+                san = (move.colsToFiles[move.startCol] + capture if capture else "") + destination
+                if move.isPawnPromotion:
+                    san += "=" + move.promotionPiece
+            else:
+                # other pieces of the same type that can reach the same square decide how much of the start is named
+                board = self.board
+                end = move.endRow*8 + move.endCol
+                start = move.startRow*8 + move.startCol
+                rivals = []
+                for packed in self.getValidMovesPacked():
+                    other = packed & 63
+                    if (packed >> 6) & 63 == end and other != start and board[other >> 3][other & 7] == move.pieceMoved:
+                        rivals.append(other)
+                disambiguation = ""
+                if rivals:
+                    if all(other & 7 != move.startCol for other in rivals):
+                        disambiguation = move.colsToFiles[move.startCol]
+                    elif all(other >> 3 != move.startRow for other in rivals):
+                        disambiguation = move.rowsToRanks[move.startRow]
+                    else:
+                        disambiguation = move.getRankFile(move.startRow, move.startCol)
+                san = pieceType + disambiguation + capture + destination
+        checkmate, stalemate = self.checkmate, self.stalemate
+        self.makeMove(move)
+        if self.inCheck():
+            san += "#" if len(self.getValidMovesPacked()) == 0 else "+"
+        self.undoMove()
+        self.checkmate, self.stalemate = checkmate, stalemate
+        return san
+
+    # The legal Move a SAN string names in the current position. Check marks and annotations ("+", "#", "!", "?")
+    # are ignored and "0-0" is read as "O-O". Raises ValueError when no legal move, or more than one, matches.
+    def parseSAN(self, san):
+        text = san.rstrip("+#!?")
+        board = self.board
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            kingside = len(text) == 3
+            for packed in self.getValidMovesPacked():
+                if packed & MOVE_CASTLE and (((packed >> 6) & 7) > (packed & 7)) == kingside:
+                    return Move.fromPacked(packed, board)
+            raise ValueError("illegal move %s in %s" % (san, self.getFEN()))
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError("not a SAN move: " + san)
+        pieceType, fromFile, fromRank, destination, promotion = match.groups()
+        pieceType = pieceType or "p"
+        end = Move.ranksToRows[destination[1]]*8 + Move.filesToCols[destination[0]]
+        fromCol = Move.filesToCols[fromFile] if fromFile else None
+        fromRow = Move.ranksToRows[fromRank] if fromRank else None
+        promotionIndex = PROMOTION_PIECES.index(promotion) if promotion else None
+        matches = []
+        for packed in self.getValidMovesPacked():
+            start = packed & 63
+            if (packed >> 6) & 63 != end or packed & MOVE_CASTLE or board[start >> 3][start & 7][1] != pieceType:
+                continue
+            if (fromCol is not None and start & 7 != fromCol) or (fromRow is not None and start >> 3 != fromRow):
+                continue
+            if pieceType == "p" and (end < 8 or end >= 56): # promotions have to name their piece
+                if promotionIndex is None or (packed >> 12) & 3 != promotionIndex:
+                    continue
+            elif promotionIndex is not None:
+                continue
+            matches.append(packed)
+        if len(matches) != 1:
+            raise ValueError("%s move %s in %s" % ("illegal" if not matches else "ambiguous", san, self.getFEN()))
+        return Move.fromPacked(matches[0], board)
+
+    # Everything about the position that a move can't be taken back from, packed into one int:
+    # bits 0-3 castling rights (CastleRights.index()), 4-10 enpassant square + 1 (0 for none), 11-14 captured
+    # piece (index into PIECES + 1, 0 for none), 15-22 phase and from bit 23 up the halfmove clock
+    def packState(self, captured):
+        enpassant = self.enpassantPossible
+        return (self.currentCastlingRights.index()
+                | ((enpassant[0]*8 + enpassant[1] + 1 if enpassant else 0) << 4)
+                | (STATE_PIECE_CODES[captured] << 11)
+                | (self.phase << 15)
+                | (self.halfmoveClock << 23))
 
     def makeMove(self, move):
+        # one stack entry per ply: the packed state plus the two values too wide to share an int with it
+        self.stateLog.append((self.packState(move.pieceCaptured), self.zobristKey, self.mgScore, self.egScore))
+        self.updateEvaluation(move)
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[move.pieceMoved][move.startRow*8 + move.startCol]
+        pieceSquares = self.pieceSquares
+        pieceSquares[move.pieceMoved].remove(move.startRow*8 + move.startCol)
+        if move.pieceCaptured != "--" and not move.isEnpassantMove:
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow*8 + move.endCol]
+            pieceSquares[move.pieceCaptured].remove(move.endRow*8 + move.endCol)
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move) # add move to move bank for undo
         self.whiteToMove = not self.whiteToMove # toggle white turn
+        self.halfmoveClock = 0 if move.pieceMoved[1] == "p" or move.pieceCaptured != "--" else self.halfmoveClock + 1
+        if move.pieceMoved[0] == "b":
+            self.fullmoveNumber += 1
         if move.pieceMoved == "bK":
             self.blackKingLocation = (move.endRow, move.endCol)
         elif move.pieceMoved == "wK":
             self.whiteKingLocation = (move.endRow, move.endCol)
         # handle special pawn promotion move
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow*8 + move.endCol]
+        pieceSquares[self.board[move.endRow][move.endCol]].add(move.endRow*8 + move.endCol)
         
         # Enpassant move
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = "--"
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow*8 + move.endCol]
+            pieceSquares[move.pieceCaptured].remove(move.startRow*8 + move.endCol)
         
         # Update enpassantPossible variable
+        if self.enpassantPossible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
         if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2: # clever way of checking 2 square pawn advance irrespective of color
             self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
+            key ^= ZOBRIST_ENPASSANT[move.startCol]
         else:
             self.enpassantPossible = ()
         # Castle move
         if move.isCastleMove:
             if move.endCol - move.startCol == 2: # kingside castle move
-                self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1] # moves the rook
-                self.board[move.endRow][move.endCol+1] = "--"
+                rookFrom, rookTo = move.endCol+1, move.endCol-1
             else: # queenside castle
-                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2] # moves the rook
-                self.board[move.endRow][move.endCol-2] = "--"
+                rookFrom, rookTo = move.endCol-2, move.endCol+1
+            rook = self.board[move.endRow][rookFrom]
+            self.board[move.endRow][rookTo] = rook # moves the rook
+            self.board[move.endRow][rookFrom] = "--"
+            if rook != "--":
+                key ^= ZOBRIST_PIECES[rook][move.endRow*8 + rookFrom] ^ ZOBRIST_PIECES[rook][move.endRow*8 + rookTo]
+                pieceSquares[rook].remove(move.endRow*8 + rookFrom)
+                pieceSquares[rook].add(move.endRow*8 + rookTo)
         # Update castling rights whenever a rook or king moves for the first time
+        key ^= ZOBRIST_CASTLING[self.currentCastlingRights.index()]
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs,
-                                             self.currentCastlingRights.bks, self.currentCastlingRights.bqs))
+        key ^= ZOBRIST_CASTLING[self.currentCastlingRights.index()]
+        self.zobristKey = key
+        if DEBUG_ZOBRIST:
+            self.checkZobristKey()
+        if DEBUG_EVALUATION:
+            self.checkEvaluation()
+        if DEBUG_PIECE_SQUARES:
+            self.checkPieceSquares()
 
     def undoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
+            state, zobristKey, mgScore, egScore = self.stateLog.pop()
+            captured = STATE_PIECES[(state >> 11) & 15]
+            pieceSquares = self.pieceSquares
+            pieceSquares[self.board[move.endRow][move.endCol]].remove(move.endRow*8 + move.endCol) # may be the promoted piece
+            pieceSquares[move.pieceMoved].add(move.startRow*8 + move.startCol)
+            if captured != "--":
+                if move.isEnpassantMove:
+                    pieceSquares[captured].add(move.startRow*8 + move.endCol)
+                else:
+                    pieceSquares[captured].add(move.endRow*8 + move.endCol)
             self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.board[move.endRow][move.endCol] = captured
             self.whiteToMove = not self.whiteToMove
             if move.pieceMoved == "bK":
                 self.blackKingLocation = (move.startRow, move.startCol)
@@ -83,23 +309,106 @@ class Game():
                 self.whiteKingLocation = (move.startRow, move.startCol)
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--" # leave landing square blank
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-            # Undo castling rights
-            self.castleRightsLog.pop() # get rid of the new castle rights from the move we are undoing
-            newRights = self.castleRightsLog[-1]
-            self.currentCastlingRights = CastleRights(newRights.wks, newRights.wqs, 
-                                                      newRights.bks, newRights.bqs) # set the current castle rights to the last one in the list
+                self.board[move.startRow][move.endCol] = captured
+            self.currentCastlingRights.setIndex(state & 15)
+            self.enpassantPossible = STATE_ENPASSANT_SQUARES[(state >> 4) & 127]
+            self.phase = (state >> 15) & 255
+            self.halfmoveClock = state >> 23
+            self.zobristKey = zobristKey
+            self.mgScore, self.egScore = mgScore, egScore
+            if move.pieceMoved[0] == "b":
+                self.fullmoveNumber -= 1
             # Undo castle move
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2: # kingside
-                    self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1] # move rook back
-                    self.board[move.endRow][move.endCol-1] = "--" # leave a blank where the rook was
+                    rookFrom, rookTo = move.endCol+1, move.endCol-1
                 else: # queenside
-                    self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1] # move rook back
-                    self.board[move.endRow][move.endCol+1] = "--" # leave a blank where the rook was
+                    rookFrom, rookTo = move.endCol-2, move.endCol+1
+                rook = self.board[move.endRow][rookTo]
+                self.board[move.endRow][rookFrom] = rook # move rook back
+                self.board[move.endRow][rookTo] = "--" # leave a blank where the rook was
+                if rook != "--":
+                    pieceSquares[rook].remove(move.endRow*8 + rookTo)
+                    pieceSquares[rook].add(move.endRow*8 + rookFrom)
+            if DEBUG_ZOBRIST:
+                self.checkZobristKey()
+            if DEBUG_EVALUATION:
+                self.checkEvaluation()
+            if DEBUG_PIECE_SQUARES:
+                self.checkPieceSquares()
+
+    # Squares of every piece on the board, {piece: set of sq} with sq = row*8 + col
+    def computePieceSquares(self):
+        pieceSquares = {piece: set() for piece in PIECES}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    pieceSquares[piece].add(row*8 + col)
+        return pieceSquares
+
+    def checkPieceSquares(self):
+        assert self.pieceSquares == self.computePieceSquares(), "piece squares out of sync with the board"
+
+    # Apply the evaluation change of a move before it is played on the board
+    def updateEvaluation(self, move):
+        start = move.startRow*8 + move.startCol
+        end = move.endRow*8 + move.endCol
+        placed = move.pieceMoved[0] + move.promotionPiece if move.isPawnPromotion else move.pieceMoved
+        mg = self.mgScore - PIECE_SQUARE_MG[move.pieceMoved][start] + PIECE_SQUARE_MG[placed][end]
+        eg = self.egScore - PIECE_SQUARE_EG[move.pieceMoved][start] + PIECE_SQUARE_EG[placed][end]
+        phase = self.phase + GAME_PHASE[placed[1]] - GAME_PHASE[move.pieceMoved[1]]
+        if move.pieceCaptured != "--":
+            captured = move.startRow*8 + move.endCol if move.isEnpassantMove else end
+            mg -= PIECE_SQUARE_MG[move.pieceCaptured][captured]
+            eg -= PIECE_SQUARE_EG[move.pieceCaptured][captured]
+            phase -= GAME_PHASE[move.pieceCaptured[1]]
+        if move.isCastleMove:
+            rookFrom, rookTo = (end + 1, end - 1) if move.endCol - move.startCol == 2 else (end - 2, end + 1)
+            rook = self.board[move.startRow][rookFrom & 7]
+            if rook != "--":
+                mg += PIECE_SQUARE_MG[rook][rookTo] - PIECE_SQUARE_MG[rook][rookFrom]
+                eg += PIECE_SQUARE_EG[rook][rookTo] - PIECE_SQUARE_EG[rook][rookFrom]
+        self.mgScore, self.egScore, self.phase = mg, eg, phase
+
+    # Evaluation terms of the position from scratch: (middlegame score, endgame score, phase)
+    def computeEvaluation(self):
+        mg = eg = phase = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    mg += PIECE_SQUARE_MG[piece][row*8 + col]
+                    eg += PIECE_SQUARE_EG[piece][row*8 + col]
+                    phase += GAME_PHASE[piece[1]]
+        return mg, eg, phase
+
+    def checkEvaluation(self):
+        assert (self.mgScore, self.egScore, self.phase) == self.computeEvaluation(), \
+            "incremental evaluation out of sync after " + (self.moveLog[-1].getChessNotation() if self.moveLog else "setup")
+
+    # Tapered evaluation in pawns from white's point of view, constant time
+    def evaluate(self):
+        phase = min(self.phase, MAX_PHASE)
+        return (self.mgScore*phase + self.egScore*(MAX_PHASE - phase)) / (MAX_PHASE*100)
+
+    # Hash of the position from scratch: pieces, side to move, castling rights and enpassant file
+    def computeZobristKey(self):
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row*8 + col]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key ^ ZOBRIST_CASTLING[self.currentCastlingRights.index()]
+
+    def checkZobristKey(self):
+        assert self.zobristKey == self.computeZobristKey(), "incremental zobrist key out of sync after " + \
+            (self.moveLog[-1].getChessNotation() if self.moveLog else "setup")
 
     def updateCastleRights(self, move):
         if move.pieceMoved == "wK":
@@ -120,41 +429,126 @@ class Game():
                     self.currentCastlingRights.bqs = False
                 elif move.startCol == 7:
                     self.currentCastlingRights.bks = False
+        # A rook captured on its starting square takes that side's castling with it
+        if move.pieceCaptured == "wR" and move.endRow == 7:
+            if move.endCol == 0:
+                self.currentCastlingRights.wqs = False
+            elif move.endCol == 7:
+                self.currentCastlingRights.wks = False
+        elif move.pieceCaptured == "bR" and move.endRow == 0:
+            if move.endCol == 0:
+                self.currentCastlingRights.bqs = False
+            elif move.endCol == 7:
+                self.currentCastlingRights.bks = False
     
     # All moves, considers checks
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.wqs,
-                                        self.currentCastlingRights.bks, self.currentCastlingRights.bqs)
-        # 5 step algorithm:
-        # 1) Generate all possible moves
-        moves = self.getAllPossibleMoves()
-        if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+        board = self.board
+        return [Move.fromPacked(packed, board) for packed in self.getValidMovesPacked()]
+
+    # All moves, considers checks, as packed ints (see Move) so callers only build the Move objects they play.
+    # Pins, checkers and the squares that stop a check are found once per position, so ordinary moves
+    # are kept or dropped with a constant time test instead of making every move and regenerating the
+    # opponent's replies.
+    def getValidMovesPacked(self):
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = kingRow*8 + kingCol
+        pins, checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        if len(checks) > 1: # double check, only the king can move
+            candidates = []
+            self.getKingMoves(kingRow, kingCol, candidates)
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-        # 2) For each move, make the move
-        for i in range(len(moves)-1, -1, -1):
-            self.makeMove(moves[i])
-            # 3) Generate all opponent's moves
-            # 4) For each of your opponents moves, see if they attack the king
-            self.whiteToMove = not self.whiteToMove # make sure inCheck() is running from the correct perspective 
-            if self.inCheck():
-                moves.remove(moves[i]) # 5) if they do attack your king, not a valid move
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
+            candidates = self.getAllPossibleMoves()
+            if len(checks) == 0: # can't castle out of check
+                self.getCastleMoves(kingRow, kingCol, candidates)
+        blockSquares = None # squares a non-king move has to land on, None when not in check
+        if len(checks) == 1:
+            checkRow, checkCol, dRow, dCol = checks[0]
+            if self.board[checkRow][checkCol][1] in "Np": # knight and pawn checks can't be blocked
+                blockSquares = {checkRow*8 + checkCol}
+            else:
+                blockSquares = set()
+                for i in range(1, 8):
+                    square = (kingRow + dRow*i)*8 + kingCol + dCol*i
+                    blockSquares.add(square)
+                    if square == checkRow*8 + checkCol:
+                        break
+        moves = []
+        for packed in candidates:
+            if packed & MOVE_CASTLE: # getCastleMoves already checked every square the king crosses
+                moves.append(packed)
+            elif packed & 63 == kingSq:
+                # lift the king off the board so it can't hide behind itself on a checking ray
+                end = (packed >> 6) & 63
+                king = self.board[kingRow][kingCol]
+                self.board[kingRow][kingCol] = "--"
+                if not self.squareUnderAttack(end >> 3, end & 7):
+                    moves.append(packed)
+                self.board[kingRow][kingCol] = king
+            elif packed & MOVE_ENPASSANT:
+                # enpassant removes two pieces from one rank, so it is still verified by playing it
+                self.makeMove(Move.fromPacked(packed, self.board))
+                self.whiteToMove = not self.whiteToMove
+                if not self.inCheck():
+                    moves.append(packed)
+                self.whiteToMove = not self.whiteToMove
+                self.undoMove()
+            else:
+                end = (packed >> 6) & 63
+                if blockSquares is not None and end not in blockSquares:
+                    continue
+                if pins:
+                    start = packed & 63
+                    pin = pins.get(start)
+                    if pin is not None and ((end >> 3) - (start >> 3))*pin[1] != ((end & 7) - (start & 7))*pin[0]:
+                        continue # pinned pieces can only move along the pin
+                moves.append(packed)
         if len(moves) == 0: # either checkmate or stalemate
-            if self.inCheck():
+            if len(checks) > 0:
                 self.checkmate = True
             else:
                 self.stalemate = True
         else: # undo a move where stalemate or checkmate was true
             self.checkmate = False
             self.stalemate = False
-        self.currentCastlingRights = tempCastleRights
-        self.enpassantPossible = tempEnpassantPossible
         return moves
 
+    # Look outward from the king for pinned allied pieces and enemy pieces giving check.
+    # Returns pins as {sq: (dRow, dCol)} with sq = row*8 + col, and checks as [(row, col, dRow, dCol)],
+    # where (dRow, dCol) is the direction from the king to the piece.
+    def checkForPinsAndChecks(self, kingRow, kingCol):
+        pins = {}
+        checks = []
+        board = self.board
+        allyColor, enemyColor = ("w", "b") if self.whiteToMove else ("b", "w")
+        pawnRow = -1 if self.whiteToMove else 1 # enemy pawns attack the king from this row offset
+        kingSq = kingRow*8 + kingCol
+        rays = RAY_TARGETS[kingSq]
+        for j in range(8):
+            dRow, dCol = DIRECTIONS[j]
+            possiblePin = None
+            for i, (endRow, endCol, endSq) in enumerate(rays[j], 1):
+                endPiece = board[endRow][endCol]
+                if endPiece == "--":
+                    continue
+                if endPiece[0] == allyColor:
+                    if possiblePin is None: # first allied piece could be pinned
+                        possiblePin = endSq
+                        continue
+                    break # second allied piece, no pin or check possible in this direction
+                pieceType = endPiece[1]
+                if ((j < 4 and pieceType == "R") or (j >= 4 and pieceType == "B") or pieceType == "Q" or
+                        (i == 1 and pieceType == "K") or (i == 1 and pieceType == "p" and dRow == pawnRow and j >= 4)):
+                    if possiblePin is None:
+                        checks.append((endRow, endCol, dRow, dCol))
+                    else:
+                        pins[possiblePin] = (dRow, dCol)
+                break # enemy piece blocks anything further along
+        for endRow, endCol, endSq in KNIGHT_TARGETS[kingSq]:
+            if board[endRow][endCol] == enemyColor + "N":
+                checks.append((endRow, endCol, endRow - kingRow, endCol - kingCol))
+        return pins, checks
+
     def inCheck(self):
         if self.whiteToMove:
             return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
@@ -163,93 +557,118 @@ class Game():
 
     # Determine if the enemy can attack square row, col (used with king location)
     def squareUnderAttack(self, row, col):
-        self.whiteToMove = not self.whiteToMove # switch to opponents POV
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove # switch back from opponents POV
-        for move in oppMoves:
-            if move.endRow == row and move.endCol == col:
-                return True
-        return False
-    
-    # All moves, not considering checks
+        enemyColor = "b" if self.whiteToMove else "w"
+        return len(self.getAttackers(row, col, enemyColor, firstOnly=True)) > 0
+
+    # Locations of the pieces of color ("w" or "b") that attack square row, col.
+    # Only the attacking side's pieces are visited, sliders are checked for a clear line to the square,
+    # so no moves are generated.
+    # With firstOnly the search stops at the first attacker found.
+    def getAttackers(self, row, col, color, firstOnly=False):
+        attackers = []
+        board = self.board
+        pieceSquares = self.pieceSquares
+        # The piece sets only say where to look, the board decides: static exchange lifts pieces off the
+        # board without telling the sets, and a lifted piece must neither attack nor block.
+        target = row*8 + col
+        for sq in pieceSquares[color + "N"] & KNIGHT_SQUARES[target]:
+            if board[sq >> 3][sq & 7] == color + "N":
+                attackers.append((sq >> 3, sq & 7))
+                if firstOnly:
+                    return attackers
+        if pieceSquares[color + "p"]:
+            # a pawn of color attacks the square from where an opposite colored pawn on it would capture
+            for endRow, endCol, endSq in PAWN_CAPTURE_TARGETS["b" if color == "w" else "w"][target]:
+                if board[endRow][endCol] == color + "p":
+                    attackers.append((endRow, endCol))
+                    if firstOnly:
+                        return attackers
+        for sq in pieceSquares[color + "K"] & KING_SQUARES[target]:
+            if board[sq >> 3][sq & 7] == color + "K":
+                attackers.append((sq >> 3, sq & 7))
+                if firstOnly:
+                    return attackers
+        lineDirections = LINE_DIRECTIONS[target]
+        for piece, directions in ((color + "R", ROOK_DIRECTIONS), (color + "B", BISHOP_DIRECTIONS),
+                                  (color + "Q", QUEEN_DIRECTIONS)):
+            for sq in pieceSquares[piece]:
+                direction = lineDirections[sq]
+                if direction not in directions or board[sq >> 3][sq & 7] != piece:
+                    continue
+                # walk from the square towards the slider, every square in between has to be empty
+                for endRow, endCol, endSq in RAY_TARGETS[target][direction]:
+                    if endSq == sq:
+                        attackers.append((endRow, endCol))
+                        if firstOnly:
+                            return attackers
+                        break
+                    if board[endRow][endCol] != "--":
+                        break
+        return attackers
+
+    # All moves, not considering checks, as packed ints
     def getAllPossibleMoves(self):
         moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0] # color of the piece, "w" or "b"
-                if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove):
-                    piece = self.board[row][col][1]
-                    self.moveFunctions[piece](row, col, moves) # python doesn't have a switch statement
-
+        pieceSquares = self.pieceSquares
+        for piece in (WHITE_PIECES if self.whiteToMove else BLACK_PIECES): # only squares the side to move occupies
+            moveFunction = self.moveFunctions[piece[1]]
+            for sq in pieceSquares[piece]:
+                moveFunction(sq >> 3, sq & 7, moves)
         return moves
 
     def getPawnMoves(self, row, col, moves):
-        if self.whiteToMove: # white pawn moves
-            # Pawn pushes
-            if self.board[row-1][col] == "--": # 1 tile pawn push
-                moves.append(Move((row, col), (row-1, col), self.board))
-                # Check 2 spaces ahead only after checking one space ahead!
-                if row == 6 and self.board[row-2][col] == "--": # 2 tile pawn push can only occur on 2nd rank for white pawns
-                    moves.append(Move((row, col),(row -2, col), self.board))
-            # Pawn captures
-            if col - 1 >= 0: # captures to the left (left being col 0)
-                if self.board[row-1][col-1][0] == "b": # enemy piece to capture
-                    moves.append(Move((row, col), (row-1, col-1), self.board))
-                elif (row-1, col-1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row-1, col-1), self.board, isEnpassantMove=True))
-            if col + 1 < 8: # captures to the right (right being col 7)
-                if self.board[row-1][col+1][0] == "b": # enemy piece to capture
-                    moves.append(Move((row, col), (row-1, col+1), self.board))
-                elif (row-1, col+1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row-1, col+1), self.board, isEnpassantMove=True))                    
-        else: # black pawn moves
-            # Pawn pushes
-            if self.board[row+1][col] == "--": # 1 tile pawn push
-                moves.append(Move((row, col), (row+1, col), self.board))
+        board = self.board
+        if self.whiteToMove: # white pawns move up the board and start on row 6
+            step, homeRow, color, enemyColor = -1, 6, "w", "b"
+        else: # black pawns move down the board and start on row 1
+            step, homeRow, color, enemyColor = 1, 1, "b", "w"
+        # Pawn pushes
+        if board[row+step][col] == "--": # 1 tile pawn push
+            self.addPawnMove(row, col, row+step, col, moves)
             # Check 2 spaces ahead only after checking one space ahead!
-                if row == 1 and self.board[row+2][col] == "--": # 2 tile pawn push can only occur on 7th rank for black pawns
-                    moves.append(Move((row, col),(row+2, col), self.board))
-            # Pawn captures
-            if col - 1 >= 0: # captures to the left (left being col 0)
-                if self.board[row+1][col-1][0] == "w": # enemy piece to capture
-                    moves.append(Move((row, col), (row+1, col-1), self.board))
-                elif (row+1, col-1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row+1, col-1), self.board, isEnpassantMove=True))
-            if col + 1 < 8: # captures to the right (right being col 7)
-                if self.board[row+1][col+1][0] == "w": # enemy piece to capture 
-                    moves.append(Move((row, col), (row+1, col+1), self.board))
-                elif (row+1, col+1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row+1, col+1), self.board, isEnpassantMove=True))
+            if row == homeRow and board[row+2*step][col] == "--":
+                self.addPawnMove(row, col, row+2*step, col, moves)
+        # Pawn captures
+        for endRow, endCol, endSq in PAWN_CAPTURE_TARGETS[color][row*8 + col]:
+            if board[endRow][endCol][0] == enemyColor: # enemy piece to capture
+                self.addPawnMove(row, col, endRow, endCol, moves)
+            elif (endRow, endCol) == self.enpassantPossible:
+                self.addPawnMove(row, col, endRow, endCol, moves, MOVE_ENPASSANT)
+
+    # Adds a pawn move, or one move per promotion piece when the pawn reaches the last rank
+    def addPawnMove(self, row, col, endRow, endCol, moves, flags=0):
+        packed = row*8 + col | (endRow*8 + endCol) << 6 | flags
+        if endRow == 0 or endRow == 7:
+            moves.extend(packed | promotion << 12 for promotion in range(len(PROMOTION_PIECES)))
+        else:
+            moves.append(packed)
 
     def getRookMoves(self, row, col, moves):
-        directions = ((-1,0), (1,0), (0,-1), (0,1))
+        self.getSlidingMoves(row, col, moves, ROOK_DIRECTIONS)
+
+    # Moves along each ray in directions (see DIRECTIONS) up to the first piece, capturing it if it's an enemy
+    def getSlidingMoves(self, row, col, moves, directions):
+        board = self.board
         enemyColor = "b" if self.whiteToMove else "w"
+        start = row*8 + col
+        rays = RAY_TARGETS[start]
         for direction in directions:
-            for i in range(1,8): # only need to check a max of 7 tiles in a given direction
-                endRow = row + direction[0] * i
-                endCol = col + direction[1] * i
-                if(0 <= endRow < 8 and 0 <= endCol < 8): # check if spot is on the board
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                        break # quit searching in this direction, can't jump over pieces
-                    else:
-                        break
-                else: # off board
-                    break
+            for endRow, endCol, endSq in rays[direction]:
+                endPiece = board[endRow][endCol]
+                if endPiece == "--":
+                    moves.append(start | endSq << 6)
+                else:
+                    if endPiece[0] == enemyColor:
+                        moves.append(start | endSq << 6)
+                    break # quit searching in this direction, can't jump over pieces
 
     def getKingMoves(self, row, col, moves):
-        kingMoves = ((-1,-1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+        board = self.board
         allyColor = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            endRow = row + kingMoves[i][0]
-            endCol = col + kingMoves[i][1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:# if the spot you're considering isn't already occupied by an ally
-                    moves.append(Move((row, col), (endRow, endCol), self.board))
+        start = row*8 + col
+        for endRow, endCol, endSq in KING_TARGETS[start]:
+            if board[endRow][endCol][0] != allyColor: # if the spot you're considering isn't already occupied by an ally
+                moves.append(start | endSq << 6)
 
     def getCastleMoves(self, row, col, moves):
         if self.squareUnderAttack(row, col):
@@ -262,46 +681,202 @@ class Game():
     def getKingsideCastleMoves(self, row, col, moves):
         if self.board[row][col+1] == "--" and self.board[row][col+2] == "--":
             if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, isCastleMove = True))
+                moves.append(row*8 + col | (row*8 + col + 2) << 6 | MOVE_CASTLE)
 
     def getQueensideCastleMoves(self, row, col, moves):
         if self.board[row][col-1] == "--" and self.board[row][col-2] == "--" and self.board[row][col-3] == "--":
             if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, isCastleMove = True))
+                moves.append(row*8 + col | (row*8 + col - 2) << 6 | MOVE_CASTLE)
     
     def getQueenMoves(self, row, col, moves):
-        self.getRookMoves(row, col, moves)
-        self.getBishopMoves(row, col, moves)
+        self.getSlidingMoves(row, col, moves, QUEEN_DIRECTIONS)
 
     def getKnightMoves(self, row, col, moves):
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        board = self.board
         allyColor = "w" if self.whiteToMove else "b"
-        for knightMove in knightMoves:
-            endRow = row + knightMove[0]
-            endCol = col + knightMove[1]
-            if(0 <= endRow < 8 and 0 <= endCol < 8):
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:
-                    moves.append(Move((row, col), (endRow, endCol), self.board))
+        start = row*8 + col
+        for endRow, endCol, endSq in KNIGHT_TARGETS[start]:
+            if board[endRow][endCol][0] != allyColor:
+                moves.append(start | endSq << 6)
 
     def getBishopMoves(self, row, col, moves):
-        directions = ((-1,-1), (-1,1), (1,-1), (1,1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for direction in directions:
-            for i in range(1,8): # only need to check a max of 7 tiles in a given direction
-                endRow = row + direction[0] * i
-                endCol = col + direction[1] * i
-                if(0 <= endRow < 8 and 0 <= endCol < 8): # check if spot is on the board
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((row, col), (endRow, endCol), self.board))
-                        break # quit searching in this direction, can't jump over pieces
-                    else:
-                        break
-                else: # off board
-                    break
+        self.getSlidingMoves(row, col, moves, BISHOP_DIRECTIONS)
+
+###########################################
+# Squares and Pieces
+###########################################
+
+# Squares are numbered the way the grid is read: sq = row*8 + col (a8 = 0, h1 = 63)
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+WHITE_PIECES = PIECES[:6]
+BLACK_PIECES = PIECES[6:]
+
+# (row, col) step for each direction, indexed by direction number
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+###########################################
+# Square Tables
+###########################################
+
+# Per-square targets so generators and attack checks skip the offset arithmetic and
+# bounds checks. Every target is (row, col, sq), rays run outward from the square, nearest first.
+def buildStepTargets(steps):
+    targets = []
+    for sq in range(64):
+        row, col = sq >> 3, sq & 7
+        targets.append(tuple((row + dRow, col + dCol, (row + dRow)*8 + col + dCol) for dRow, dCol in steps
+                             if 0 <= row + dRow < 8 and 0 <= col + dCol < 8))
+    return targets
+
+# Same targets as a set of squares per square, for intersecting with the piece square sets
+def buildSquareSets(targets):
+    return [frozenset(endSq for endRow, endCol, endSq in squareTargets) for squareTargets in targets]
+
+def buildRayTargets():
+    targets = []
+    for sq in range(64):
+        rays = []
+        for dRow, dCol in DIRECTIONS:
+            ray = []
+            row, col = (sq >> 3) + dRow, (sq & 7) + dCol
+            while 0 <= row < 8 and 0 <= col < 8:
+                ray.append((row, col, row*8 + col))
+                row, col = row + dRow, col + dCol
+            rays.append(tuple(ray))
+        targets.append(tuple(rays))
+    return targets
+
+# LINE_DIRECTIONS[sq][other] is the direction from sq to other when they share a rank, file or diagonal, else -1
+def buildLineDirections():
+    lines = []
+    for sq in range(64):
+        directions = [-1] * 64
+        for direction in range(8):
+            for endRow, endCol, endSq in RAY_TARGETS[sq][direction]:
+                directions[endSq] = direction
+        lines.append(directions)
+    return lines
+
+tablesStartTime = time.perf_counter()
+KNIGHT_TARGETS = buildStepTargets(KNIGHT_STEPS)
+KING_TARGETS = buildStepTargets(DIRECTIONS)
+PAWN_CAPTURE_TARGETS = {"w": buildStepTargets(((-1, -1), (-1, 1))), "b": buildStepTargets(((1, -1), (1, 1)))}
+KNIGHT_SQUARES = buildSquareSets(KNIGHT_TARGETS)
+KING_SQUARES = buildSquareSets(KING_TARGETS)
+RAY_TARGETS = buildRayTargets() # RAY_TARGETS[sq][direction], direction numbered as in DIRECTIONS
+LINE_DIRECTIONS = buildLineDirections()
+SQUARE_TABLES_BUILD_SECONDS = time.perf_counter() - tablesStartTime # a few milliseconds, small next to the rest of the import
+del tablesStartTime
+
+###########################################
+# Evaluation Tables
+###########################################
+
+pieceScore = {"K":0, "Q":9, "B":3, "R":5, "p":1, "N":3}
+
+# How much each piece counts towards the middlegame, a full set of pieces is MAX_PHASE
+GAME_PHASE = {"K":0, "Q":4, "R":2, "B":1, "N":1, "p":0}
+MAX_PHASE = 24
+
+# Piece-square bonuses in centipawns for white pieces, laid out like the board (a8 first, h1 last).
+# Black pieces read the table mirrored top to bottom.
+PST_MG = {
+    "p": (  0,   0,   0,   0,   0,   0,   0,   0,
+           50,  50,  50,  50,  50,  50,  50,  50,
+           10,  10,  20,  30,  30,  20,  10,  10,
+            5,   5,  10,  25,  25,  10,   5,   5,
+            0,   0,   0,  20,  20,   0,   0,   0,
+            5,  -5, -10,   0,   0, -10,  -5,   5,
+            5,  10,  10, -20, -20,  10,  10,   5,
+            0,   0,   0,   0,   0,   0,   0,   0),
+    "N": (-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20,   0,   0,   0,   0, -20, -40,
+          -30,   0,  10,  15,  15,  10,   0, -30,
+          -30,   5,  15,  20,  20,  15,   5, -30,
+          -30,   0,  15,  20,  20,  15,   0, -30,
+          -30,   5,  10,  15,  15,  10,   5, -30,
+          -40, -20,   0,   5,   5,   0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50),
+    "B": (-20, -10, -10, -10, -10, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,  10,  10,   5,   0, -10,
+          -10,   5,   5,  10,  10,   5,   5, -10,
+          -10,   0,  10,  10,  10,  10,   0, -10,
+          -10,  10,  10,  10,  10,  10,  10, -10,
+          -10,   5,   0,   0,   0,   0,   5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20),
+    "R": (  0,   0,   0,   0,   0,   0,   0,   0,
+            5,  10,  10,  10,  10,  10,  10,   5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+            0,   0,   0,   5,   5,   0,   0,   0),
+    "Q": (-20, -10, -10,  -5,  -5, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,   5,   5,   5,   0, -10,
+           -5,   0,   5,   5,   5,   5,   0,  -5,
+            0,   0,   5,   5,   5,   5,   0,  -5,
+          -10,   5,   5,   5,   5,   5,   0, -10,
+          -10,   0,   5,   0,   0,   0,   0, -10,
+          -20, -10, -10,  -5,  -5, -10, -10, -20),
+    "K": (-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+           20,  20,   0,   0,   0,   0,  20,  20,
+           20,  30,  10,   0,   0,  10,  30,  20),
+}
+PST_EG = dict(PST_MG)
+PST_EG["p"] = (  0,   0,   0,   0,   0,   0,   0,   0,
+                80,  80,  80,  80,  80,  80,  80,  80,
+                50,  50,  50,  50,  50,  50,  50,  50,
+                30,  30,  30,  30,  30,  30,  30,  30,
+                15,  15,  15,  15,  15,  15,  15,  15,
+                 5,   5,   5,   5,   5,   5,   5,   5,
+                 0,   0,   0,   0,   0,   0,   0,   0,
+                 0,   0,   0,   0,   0,   0,   0,   0)
+PST_EG["K"] = (-50, -40, -30, -20, -20, -30, -40, -50,
+               -30, -20, -10,   0,   0, -10, -20, -30,
+               -30, -10,  20,  30,  30,  20, -10, -30,
+               -30, -10,  30,  40,  40,  30, -10, -30,
+               -30, -10,  30,  40,  40,  30, -10, -30,
+               -30, -10,  20,  30,  30,  20, -10, -30,
+               -30, -30,   0,   0,   0,   0, -30, -30,
+               -50, -30, -30, -30, -30, -30, -30, -50)
+
+# Material plus piece-square bonus of every piece on every square, signed so white is positive
+def buildPieceSquareValues(tables):
+    values = {}
+    for piece in PIECES:
+        table = tables[piece[1]]
+        material = pieceScore[piece[1]]*100
+        if piece[0] == "w":
+            values[piece] = [material + table[sq] for sq in range(64)]
+        else:
+            values[piece] = [-(material + table[(7 - (sq >> 3))*8 + (sq & 7)]) for sq in range(64)]
+    return values
+
+PIECE_SQUARE_MG = buildPieceSquareValues(PST_MG)
+PIECE_SQUARE_EG = buildPieceSquareValues(PST_EG)
+
+###########################################
+# Zobrist Keys
+###########################################
+
+# Fixed seed so keys (and anything stored by key) are the same in every process and every run
+zobristRandom = random.Random(20240611)
+ZOBRIST_PIECES = {piece: [zobristRandom.getrandbits(64) for sq in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [zobristRandom.getrandbits(64) for rights in range(16)] # indexed by CastleRights.index()
+ZOBRIST_ENPASSANT = [zobristRandom.getrandbits(64) for col in range(8)] # indexed by file of the enpassant square
 
 ###########################################
 # Castling Rights Manager
@@ -314,18 +889,49 @@ class CastleRights():
         self.bks = bks
         self.bqs = bqs
 
+    # Rights packed into 4 bits: wks, wqs, bks, bqs
+    def index(self):
+        return self.wks | (self.wqs << 1) | (self.bks << 2) | (self.bqs << 3)
+
+    # Set the rights from their index(), in place
+    def setIndex(self, index):
+        self.wks = bool(index & 1)
+        self.wqs = bool(index & 2)
+        self.bks = bool(index & 4)
+        self.bqs = bool(index & 8)
+
+# Lookups for the packed undo state of Game.packState
+STATE_PIECES = ("--",) + PIECES # captured piece code -> piece
+STATE_PIECE_CODES = {piece: code for code, piece in enumerate(STATE_PIECES)}
+STATE_ENPASSANT_SQUARES = ((),) + tuple((sq >> 3, sq & 7) for sq in range(64)) # enpassant code -> enpassantPossible
+
 ###########################################
 # Move Object
 ###########################################
 
+# A move packed into one int, which is what the generators produce:
+# bits 0-5 start square and 6-11 end square (sq = row*8 + col), 12-13 promotion piece (index into
+# PROMOTION_PIECES), 14 enpassant flag, 15 castle flag. The low 14 bits are the moveID, which is all that
+# is needed to tell two moves of the same position apart.
+PROMOTION_PIECES = ("Q", "R", "B", "N")
+MOVE_ENPASSANT = 1 << 14
+MOVE_CASTLE = 1 << 15
+MOVE_ID_MASK = (1 << 14) - 1
+
+# piece letter, start file, start rank, capture, destination, promotion piece
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$")
+
+# Full move with the pieces involved looked up, built from a packed move only when it is needed
 class Move():
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "isPawnPromotion",
+                 "promotionPiece", "isEnpassantMove", "isCastleMove", "moveID", "packed")
     ranksToRows = {"1":7, "2":6, "3":5, "4":4, "5":3, "6":2, "7":1, "8":0}
     rowsToRanks = {v:k for k,v in ranksToRows.items()}
 
     filesToCols = {"a":0, "b":1, "c":2, "d":3,"e":4, "f":5, "g":6, "h":7}
     colsToFiles = {v:k for k,v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False):
+    def __init__(self, startSq, endSq, board, isEnpassantMove=False, isCastleMove=False, promotionPiece="Q"):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -333,12 +939,23 @@ class Move():
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
         self.isPawnPromotion = ((self.pieceMoved == "wp" and self.endRow == 0) or (self.pieceMoved == "bp" and self.endRow == 7))
+        self.promotionPiece = promotionPiece # piece type a promoting pawn becomes, "Q", "R", "B" or "N"
         self.isEnpassantMove = isEnpassantMove
         if self.isEnpassantMove:
             self.pieceCaptured = "wp" if self.pieceMoved == "bp" else "bp"
         # Castle move
         self.isCastleMove = isCastleMove
-        self.moveID = 1000*self.startRow + 100*self.startCol + 10*self.endRow + self.endCol
+        self.moveID = self.startRow*8 + self.startCol | (self.endRow*8 + self.endCol) << 6
+        if self.isPawnPromotion:
+            self.moveID |= PROMOTION_PIECES.index(promotionPiece) << 12
+        self.packed = self.moveID | (MOVE_ENPASSANT if isEnpassantMove else 0) | (MOVE_CASTLE if isCastleMove else 0)
+
+    @classmethod
+    def fromPacked(cls, packed, board):
+        start = packed & 63
+        end = (packed >> 6) & 63
+        return cls((start >> 3, start & 7), (end >> 3, end & 7), board, packed & MOVE_ENPASSANT != 0,
+                   packed & MOVE_CASTLE != 0, PROMOTION_PIECES[(packed >> 12) & 3])
     
     # Overriding the equals method
     def __eq__(self, other):
@@ -349,7 +966,10 @@ class Move():
     def getChessNotation(self):
         # Does not account for pawns only having destination noted
         # Does not account for captured piece notation
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def getRankFile(self, row, col):
         return self.colsToFiles[col] + self.rowsToRanks[row]
\ No newline at end of file
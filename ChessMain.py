@@ -9,8 +9,11 @@ It will be responsible for handling user input and displaying the current Game o
 ###########################################
 
 
+import os
+import random
+import time
 import pygame as p
-import ChessEngine, SmartMoveFinder
+import ChessEngine, SmartMoveFinder, OpeningBook, Tablebase
 
 ###########################################
 # Global Variables
@@ -20,7 +23,14 @@ WIDTH = HEIGHT = 512
 DIMENSION = 8 # dimensions of a chess board are 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15 # for animation later on
+ANIMATION_FPS = 60
+FRAME_REPORT_FRAMES = 0 # print the average and worst frame cost every this many frames, 0 for off
+PONDER = True # let the AI keep thinking on the human's time, guessing their reply
+BOOK_FILE = "book.bin" # opening book built with OpeningBook.py, the AI plays from it instantly while it can
+TABLEBASE_DIR = Tablebase.TABLEBASE_DIR # endgame tables built with Tablebase.py, used by the AI when present
 IMAGES = {}
+LIGHT_SQUARE = (255, 255, 255)
+DARK_SQUARE = (118, 150, 86)
 
 ###########################################
 # Load Assets
@@ -50,6 +60,11 @@ def main():
     moveMade = False # flag variable for when a move is made
     animate = False # flag variable for when we should animate a move
     loadImages() # only do this once, before the while loop
+    renderer = BoardRenderer()
+    # AI thinks in its own process so the window stays responsive
+    engine = SmartMoveFinder.BackgroundSearch(tablebaseDir=TABLEBASE_DIR if os.path.isdir(TABLEBASE_DIR) else None)
+    book = OpeningBook.OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else None
+    aiMoved = False # flag variable for when the AI just played, to start pondering
     running = True
     sqSelected = () # no square is selected, keep track of the last click of the user (tuple: (row,col))
     playerClicks = [] # keep track of player clicks (two tuples: [(6,4), (4,4)])
@@ -61,6 +76,8 @@ def main():
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE: # window was covered, what is on screen can't be trusted
+                renderer.invalidate()
             # Mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not gameOver and humanTurn:
@@ -78,6 +95,7 @@ def main():
                         print(move.getChessNotation())
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
+                                engine.ponderHit(validMoves[i]) # the predicted reply, keep pondering as the real search
                                 gs.makeMove(validMoves[i])
                                 moveMade = True
                                 animate = True
@@ -88,11 +106,13 @@ def main():
             # Key handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: # undo when "z" is pressed
+                    engine.cancel()
                     gs.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
                 elif e.key == p.K_r: # reset when "r" is pressed
+                    engine.cancel()
                     gs = ChessEngine.Game()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
@@ -100,106 +120,198 @@ def main():
                     moveMade = False
                     animate = False
                     gameOver = False
-        # AI move finder
+        # AI move finder, started once and then checked every frame until the answer arrives
         if not gameOver and not humanTurn:
-            AIMove = SmartMoveFinder.findRandomMove(validMoves)
-            gs.makeMove(AIMove)
-            moveMade = True
-            animate = True
+            bookMove = book.chooseMove(gs, validMoves, random) if book is not None and not engine.searching else None
+            if bookMove is not None: # known opening position, no need to search
+                engine.cancel()
+                gs.makeMove(bookMove)
+                moveMade = True
+                animate = True
+            else:
+                if not engine.searching:
+                    engine.start(gs)
+                result = engine.pollMove(validMoves)
+                if result is not None and result.bestMove is not None:
+                    gs.makeMove(result.bestMove)
+                    moveMade = True
+                    animate = True
+                    aiMoved = True
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                renderer.animateMove(screen, gs.moveLog[-1], gs.board, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
+            if aiMoved and PONDER and validMoves:
+                for move in validMoves:
+                    if move.moveID == engine.predictedMoveID:
+                        engine.ponder(gs, move)
+            aiMoved = False
 
 
-        drawGrid(screen, gs, validMoves, sqSelected)
+        text = None
         if gs.checkmate:
             gameOver = True
-            if gs.whiteToMove:
-                drawText(screen, "Black wins by checkmate")
-            else:
-                drawText(screen, "White wins by checkmate")
+            text = "Black wins by checkmate" if gs.whiteToMove else "White wins by checkmate"
         elif gs.stalemate:
             gameOver = True
-            drawText(screen, "Stalemate!")
+            text = "Stalemate!"
+        renderer.draw(screen, gs.board, highlightSquares(gs, validMoves, sqSelected), text)
         clock.tick(MAX_FPS)
-        p.display.flip()
+    engine.close()
+    if book is not None:
+        book.close()
 
 ###########################################
 # Helper Functions
 ###########################################
 
-# Highlight square selected and possible moves for piece selected
-def highlightSquares(screen, gs, validMoves, sqSelected):
+# Highlight square selected and possible moves for piece selected, as {(row, col): highlight color}
+def highlightSquares(gs, validMoves, sqSelected):
+    highlights = {}
     if sqSelected != ():
         row, col = sqSelected
         if gs.board[row][col][0] == ("w" if gs.whiteToMove else "b"):
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100) # transparency value, 0 = transparent 255 = opaque
-            s.fill(p.Color("blue"))
-            screen.blit(s, (col*SQ_SIZE, row*SQ_SIZE))
+            highlights[(row, col)] = "blue"
             # Highlight moves from that square
-            s.fill(p.Color("yellow"))
             for move in validMoves:
                 if move.startRow == row and move.startCol == col:
-                    screen.blit(s, (SQ_SIZE*move.endCol, SQ_SIZE*move.endRow))
-
-# Responsible for all the graphics within a current game state.
-def drawGrid(screen, gs, validMoves, sqSelected):
-    drawBoard(screen) # draw squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
-
-# Draw the squares on the board.
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color((118,150,86))]
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            color = colors[((row + column) % 2)]
-            p.draw.rect(screen, color, p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-# Draw the pieces on the board using the current Game.board.
-def drawPieces(screen, board):
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--": # not empty square
-                screen.blit(IMAGES[piece], p.Rect(column*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def animateMove(move, screen, board, clock):
-    global colors
-    coords = [] # list of coordinates the animation will move through
-    dRow = move.endRow - move.startRow
-    dCol = move.endCol - move.startCol
-    framesPerSquare = 10 # frames to move one square
-    frameCount = (abs(dRow) + abs(dCol)) + framesPerSquare
-    for frame in range(frameCount + 1):
-        row, col = (move.startRow + dRow*frame/frameCount, move.startCol + dCol*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # Erase the piece moved from it's ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        # Draw captured piece onto rectangle
-        if move.pieceCaptured != "--":
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        # Draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
-def drawText(screen, text):
-    font = p.font.SysFont("Helvetica", 32, True, False)
-    textObject = font.render(text, 0, p.Color("Gray"))
-    textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
-    textObject = font.render(text, 0, p.Color("Black"))
-    screen.blit(textObject, textLocation.move(2, 2))
+                    highlights[(move.endRow, move.endCol)] = "yellow"
+    return highlights
+
+###########################################
+# Rendering
+###########################################
+
+# Draws the game keeping track of what every square shows, so a frame only repaints the squares whose
+# piece, highlight or text changed and only those rects are sent to the display. The empty board,
+# highlight squares, fonts and rendered text are made once and reused.
+class BoardRenderer():
+    def __init__(self):
+        self.boardSurface = p.Surface((WIDTH, HEIGHT)).convert() # empty board, squares are copied from it
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                self.boardSurface.fill(DARK_SQUARE if (row + col) % 2 else LIGHT_SQUARE, squareRect(row, col))
+        self.highlightSurfaces = {}
+        for color in ("blue", "yellow"):
+            surface = p.Surface((SQ_SIZE, SQ_SIZE))
+            surface.set_alpha(100) # transparency value, 0 = transparent 255 = opaque
+            surface.fill(p.Color(color))
+            self.highlightSurfaces[color] = surface
+        self.fonts = {}
+        self.texts = {} # text -> (rect, [(surface, position)]) of its shadow and face
+        self.shown = None # (piece, highlight, text) on screen for each square, None when the screen is unknown
+        self.frames = 0
+        self.frameSeconds = 0.0
+        self.worstFrameSeconds = 0.0
+        self.squaresDrawn = 0
+
+    # Forget what is on screen, the next frame repaints everything
+    def invalidate(self):
+        self.shown = None
+
+    def getFont(self, name, size, bold=False, italic=False):
+        key = (name, size, bold, italic)
+        if key not in self.fonts:
+            self.fonts[key] = p.font.SysFont(name, size, bold, italic)
+        return self.fonts[key]
+
+    # Text centered on the board with a drop shadow, rendered the first time it is asked for
+    def getText(self, text):
+        if text not in self.texts:
+            font = self.getFont("Helvetica", 32, True)
+            shadow = font.render(text, 0, p.Color("Gray"))
+            face = font.render(text, 0, p.Color("Black"))
+            location = (WIDTH//2 - shadow.get_width()//2, HEIGHT//2 - shadow.get_height()//2)
+            rect = p.Rect(location, shadow.get_size()).union(p.Rect((location[0] + 2, location[1] + 2), face.get_size()))
+            self.texts[text] = (rect, [(shadow, location), (face, (location[0] + 2, location[1] + 2))])
+        return self.texts[text]
+
+    def drawSquare(self, screen, row, col, piece, highlight, text):
+        rect = squareRect(row, col)
+        screen.blit(self.boardSurface, rect, rect)
+        if highlight is not None:
+            screen.blit(self.highlightSurfaces[highlight], rect)
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        if text is not None: # only the part of the text over this square
+            screen.set_clip(rect)
+            for surface, location in self.getText(text)[1]:
+                screen.blit(surface, location)
+            screen.set_clip(None)
+        return rect
+
+    # Bring the screen up to date with board, highlights and text and push the changed squares to the display.
+    # overrides {(row, col): piece} shows something else than the board on some squares.
+    def draw(self, screen, board, highlights, text=None, overrides=None):
+        startTime = time.perf_counter()
+        textRect = self.getText(text)[0] if text is not None else None
+        if self.shown is None:
+            self.shown = [None] * (DIMENSION * DIMENSION)
+        dirty = []
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                piece = board[row][col]
+                if overrides and (row, col) in overrides:
+                    piece = overrides[(row, col)]
+                squareText = text if textRect is not None and textRect.colliderect(squareRect(row, col)) else None
+                state = (piece, highlights.get((row, col)), squareText)
+                if self.shown[row*DIMENSION + col] != state:
+                    self.shown[row*DIMENSION + col] = state
+                    dirty.append(self.drawSquare(screen, row, col, *state))
+        if len(dirty) == DIMENSION * DIMENSION:
+            p.display.update(screen.get_rect())
+        elif dirty:
+            p.display.update(dirty)
+        self.recordFrame(time.perf_counter() - startTime, len(dirty))
+        return dirty
+
+    # Slide the moved piece from its start to its end square. The board is drawn once, with the captured
+    # piece still on the end square, and each frame only restores the piece's last rect and draws its new one.
+    def animateMove(self, screen, move, board, clock):
+        self.draw(screen, board, {}, overrides={(move.endRow, move.endCol): move.pieceCaptured})
+        background = screen.copy()
+        dRow = move.endRow - move.startRow
+        dCol = move.endCol - move.startCol
+        framesPerSquare = 10 # frames to move one square
+        frameCount = (abs(dRow) + abs(dCol)) + framesPerSquare
+        previousRect = None
+        for frame in range(frameCount + 1):
+            startTime = time.perf_counter()
+            row, col = (move.startRow + dRow*frame/frameCount, move.startCol + dCol*frame/frameCount)
+            pieceRect = p.Rect(int(col*SQ_SIZE), int(row*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+            dirty = [pieceRect]
+            if previousRect is not None:
+                screen.blit(background, previousRect, previousRect)
+                dirty.append(previousRect)
+            screen.blit(IMAGES[move.pieceMoved], pieceRect)
+            p.display.update(dirty)
+            previousRect = pieceRect
+            self.recordFrame(time.perf_counter() - startTime, 0)
+            clock.tick(ANIMATION_FPS)
+        # the end square now shows the moved piece instead of what self.shown says, so the next draw repaints it
+
+    # Frame cost bookkeeping, reported every FRAME_REPORT_FRAMES frames
+    def recordFrame(self, seconds, squares):
+        self.frames += 1
+        self.frameSeconds += seconds
+        self.worstFrameSeconds = max(self.worstFrameSeconds, seconds)
+        self.squaresDrawn += squares
+        if FRAME_REPORT_FRAMES and self.frames >= FRAME_REPORT_FRAMES:
+            print(self.frameReport())
+            self.frames = 0
+            self.frameSeconds = self.worstFrameSeconds = 0.0
+            self.squaresDrawn = 0
+
+    def frameReport(self):
+        frames = max(self.frames, 1)
+        return "%d frames: %.2fms average, %.2fms worst, %.1f squares redrawn per frame" % (
+            self.frames, 1000 * self.frameSeconds / frames, 1000 * self.worstFrameSeconds, self.squaresDrawn / frames)
+
+def squareRect(row, col):
+    return p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
 
 ##########################################################################
 #########################################################################
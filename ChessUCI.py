@@ -0,0 +1,238 @@
+'''
+ChessUCI: the engine without a window, speaking the UCI protocol on stdin/stdout so any UCI GUI or test
+harness can drive it. Nothing here imports pygame, so it runs on headless machines and starts quickly.
+
+python ChessUCI.py                 talk UCI on stdin/stdout
+python ChessUCI.py --startup       print how long it takes from import to readyok and exit
+
+Commands: uci, isready, ucinewgame, setoption (Hash, BookFile, TablebaseDir), position startpos|fen ... [moves ...],
+go [depth N] [movetime MS] [wtime MS btime MS winc MS binc MS movestogo N] [nodes N] [infinite], stop, quit.
+The search runs on its own thread, so stop and isready are answered while it thinks.
+'''
+
+###########################################
+# Imports
+###########################################
+
+import time
+STARTED = time.perf_counter() # for --startup, taken before the engine modules load
+
+import os
+import sys
+import threading
+import ChessEngine
+import SmartMoveFinder
+
+###########################################
+# Settings
+###########################################
+
+ENGINE_NAME = "Chess"
+ENGINE_AUTHOR = "Shawn"
+MAX_DEPTH = 32 # depth limit for searches that are only bounded by time or stop
+MOVES_TO_GO = 30 # moves the remaining clock time is shared over when the GUI doesn't say
+MOVE_OVERHEAD_MS = 50 # kept back from every clock budget for the GUI and the pipe
+MIN_MOVE_SECONDS = 0.01
+MAX_HASH_MB = 1024
+
+###########################################
+# Engine
+###########################################
+
+# Seconds to think with remainingMs on the clock, incrementMs added per move and movesToGo until the next time control
+def allotTime(remainingMs, incrementMs=0, movesToGo=None):
+    budget = remainingMs / (movesToGo or MOVES_TO_GO) + incrementMs * 0.8
+    budget = min(budget, remainingMs / 2 - MOVE_OVERHEAD_MS) # never bet more than half the clock on one move
+    return max(MIN_MOVE_SECONDS, budget / 1000)
+
+# UCI score of a SmartMoveFinder score: "cp N" or "mate N" (moves, negative when being mated)
+def formatScore(score):
+    if abs(score) >= SmartMoveFinder.MATE_BOUND:
+        plies = SmartMoveFinder.CHECKMATE - abs(score)
+        return "mate %d" % ((plies + 1) // 2 if score > 0 else -(plies // 2))
+    return "cp %d" % int(round(score * 100))
+
+class UCIEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock() # the search thread writes info and bestmove lines too
+        self.gs = ChessEngine.Game()
+        self.hashMB = SmartMoveFinder.TT_SIZE_MB
+        self.searcher = SmartMoveFinder.Searcher(ttSizeMB=self.hashMB)
+        self.searchThread = None
+        self.searchInfinite = False
+        self.stopEvent = threading.Event()
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    # Handle one line from the GUI, returns False on quit
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (self.hashMB, MAX_HASH_MB))
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebaseDir type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher.tt.clear()
+            self.searcher.history.clear()
+            self.gs = ChessEngine.Game()
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(arguments)
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(arguments)
+        elif command == "go":
+            self.stopSearch()
+            self.go(arguments)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        # anything else (debug, register, ponderhit, unknown commands) is ignored, as UCI asks
+        return True
+
+    def setOption(self, arguments):
+        text = " ".join(arguments)
+        name, separator, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        value = value.strip()
+        if value == "<empty>":
+            value = ""
+        try:
+            if name == "hash":
+                self.hashMB = max(1, min(MAX_HASH_MB, int(value)))
+                self.searcher.tt = SmartMoveFinder.TranspositionTable(self.hashMB)
+            elif name == "bookfile":
+                if self.searcher.book is not None:
+                    self.searcher.book.close()
+                self.searcher.book = SmartMoveFinder.OpeningBook.OpeningBook(value) if value else None
+            elif name == "tablebasedir":
+                self.searcher.tablebases = SmartMoveFinder.Tablebase.Tablebases(value) if value else None
+            else:
+                self.send("info string unknown option " + name)
+        except (ValueError, OSError) as error:
+            self.send("info string option %s not set: %s" % (name, error))
+
+    # position startpos|fen <fen> [moves <move> ...], moves in coordinate notation (e2e4, e7e8q)
+    def setPosition(self, arguments):
+        movesAt = arguments.index("moves") if "moves" in arguments else len(arguments)
+        try:
+            if arguments and arguments[0] == "fen":
+                gs = ChessEngine.Game(fen=" ".join(arguments[1:movesAt]))
+            else:
+                gs = ChessEngine.Game()
+        except (ValueError, KeyError, IndexError) as error:
+            self.send("info string bad position: %s" % error)
+            return
+        for text in arguments[movesAt + 1:]:
+            move = None
+            for candidate in gs.getValidMoves():
+                if candidate.getChessNotation() == text:
+                    move = candidate
+                    break
+            if move is None:
+                self.send("info string illegal move %s in %s" % (text, gs.getFEN()))
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, arguments):
+        options = {}
+        infinite = False
+        for i in range(len(arguments)):
+            if arguments[i] == "infinite":
+                infinite = True
+            elif i + 1 < len(arguments) and arguments[i + 1].lstrip("-").isdigit():
+                options[arguments[i]] = int(arguments[i + 1])
+        depth = options.get("depth", MAX_DEPTH)
+        timeLimit = None
+        if "movetime" in options:
+            timeLimit = max(MIN_MOVE_SECONDS, options["movetime"] / 1000)
+        elif ("wtime" if self.gs.whiteToMove else "btime") in options:
+            side = "w" if self.gs.whiteToMove else "b"
+            timeLimit = allotTime(options[side + "time"], options.get(side + "inc", 0), options.get("movestogo"))
+        elif "depth" not in options and "nodes" not in options and not infinite:
+            depth = SmartMoveFinder.DEPTH # a bare "go" searches like the game does
+        self.stopEvent.clear()
+        self.searchInfinite = infinite
+        self.searchThread = threading.Thread(target=self.search, args=(self.gs, depth, timeLimit, options.get("nodes"), infinite),
+                                             daemon=True)
+        self.searchThread.start()
+
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+    # Let a search with a limit run to its end, stop one that would only end on stop
+    def finishSearch(self):
+        if self.searchThread is not None and not self.searchInfinite:
+            self.searchThread.join()
+        self.stopSearch()
+
+    # Runs on the search thread, always ends by sending bestmove
+    def search(self, gs, depth, timeLimit, nodeLimit, infinite):
+        searcher = self.searcher
+        searcher.maxDepth, searcher.timeLimit = depth, timeLimit
+        stopEvent = self.stopEvent
+        if nodeLimit is not None:
+            searcher.stopCondition = lambda: stopEvent.is_set() or searcher.nodes >= nodeLimit
+        else:
+            searcher.stopCondition = stopEvent.is_set
+        searcher.onIteration = lambda iterationDepth, score, pv, nodes, seconds: self.send(
+            "info depth %d score %s nodes %d nps %d time %d pv %s" % (iterationDepth, formatScore(score), nodes,
+            int(nodes / seconds) if seconds > 0 else 0, int(seconds * 1000), " ".join(move.getChessNotation() for move in pv)))
+        bestMove = None
+        try:
+            validMoves = gs.getValidMoves()
+            if validMoves:
+                result = searcher.search(gs, validMoves)
+                bestMove = result.bestMove
+                if result.depth == 0: # book or tablebase move, no iteration reported it
+                    self.send("info depth 0 score %s time %d pv %s" % (formatScore(result.score), int(result.elapsed * 1000),
+                                                                       bestMove.getChessNotation()))
+        except Exception as error: # the GUI still needs its bestmove, a silent thread would hang the game
+            self.send("info string search failed: %s: %s" % (type(error).__name__, error))
+        finally:
+            searcher.onIteration = None
+            searcher.stopCondition = None
+        if infinite: # UCI wants bestmove only after stop, even when the search ran out of depth first
+            stopEvent.wait()
+        self.send("bestmove " + (bestMove.getChessNotation() if bestMove is not None else "0000"))
+
+###########################################
+# Command Line
+###########################################
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--startup" in argv:
+        engine = UCIEngine(open(os.devnull, "w"))
+        engine.handle("uci")
+        engine.handle("isready")
+        print("%.1fms from import to readyok" % ((time.perf_counter() - STARTED) * 1000))
+        return 0
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            return 0
+    engine.finishSearch() # input ended without quit (a piped script), answer the last go before exiting
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
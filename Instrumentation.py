@@ -0,0 +1,247 @@
+'''
+Instrumentation: opt-in counters and timers for the search and move generation.
+Enabling it wraps the instrumented ChessEngine.Game and SmartMoveFinder methods in counting and timing
+wrappers, disabling puts the originals back, so when it is off the engine runs its own code untouched.
+Every Searcher.search made while it is on produces a report dict (optionally appended to a JSON lines
+file): calls and seconds per function, nodes, legal moves and cutoffs per ply, branching factors and the
+searcher's own statistics. Counting happens in the current process only, worker processes of the parallel
+and background searches are not seen.
+
+python Instrumentation.py                                  instrumented depth 4 search of the start position
+python Instrumentation.py --fen "<fen>" --depth 5 --json   report as JSON
+python Instrumentation.py --profile --top 30               the same search under cProfile, hottest functions
+python Instrumentation.py --profile --dump search.prof     also save the profile for pstats or snakeviz
+
+In code:
+    with Instrumentation.Instrumentation() as instrumentation:
+        searcher.search(gs)
+    print(instrumentation.reports[-1])
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import ChessEngine
+import SmartMoveFinder
+
+###########################################
+# Instrumented Functions
+###########################################
+
+# (owner, attribute, report name) of everything that gets counted and timed. Times are inclusive (a
+# function's time contains the functions it calls) and a recursive function is only timed at its outermost call.
+INSTRUMENTED = [
+    (ChessEngine.Game, "getValidMoves", "getValidMoves"),
+    (ChessEngine.Game, "getValidMovesPacked", "getValidMovesPacked"),
+    (ChessEngine.Game, "squareUnderAttack", "squareUnderAttack"),
+    (ChessEngine.Game, "getAttackers", "getAttackers"),
+    (ChessEngine.Game, "makeMove", "makeMove"),
+    (ChessEngine.Game, "undoMove", "undoMove"),
+    (ChessEngine.Game, "evaluate", "evaluate"),
+    (SmartMoveFinder.Searcher, "negamax", "negamax"),
+    (SmartMoveFinder.Searcher, "quiescence", "quiescence"),
+    (SmartMoveFinder.Searcher, "orderMoves", "orderMoves"),
+    (SmartMoveFinder.Searcher, "recordCutoff", "recordCutoff"),
+    (SmartMoveFinder, "staticExchange", "staticExchange"),
+]
+
+###########################################
+# Instrumentation
+###########################################
+
+class Instrumentation():
+    def __init__(self, reportPath=None):
+        self.reportPath = reportPath # JSON lines file every search report is appended to, None for none
+        self.reports = [] # one report dict per search made while enabled
+        self.originals = {}
+        self.reset()
+
+    def reset(self):
+        self.calls = {} # report name -> [calls, seconds, active (calls in progress, for recursion)]
+        self.nodesPerPly = {}
+        self.quiescenceNodesPerPly = {}
+        self.generationsPerPly = {} # getValidMovesPacked calls at each ply
+        self.movesPerPly = {} # legal moves those calls returned
+        self.cutoffsPerPly = {}
+        self.firstMoveCutoffsPerPly = {}
+        self.rootPly = 0 # length of the move log at the root of the search being measured
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exception):
+        self.disable()
+        return False
+
+    def enable(self):
+        if self.originals:
+            return
+        for owner, attribute, name in INSTRUMENTED:
+            original = owner.__dict__[attribute] if isinstance(owner, type) else getattr(owner, attribute)
+            self.originals[(owner, attribute)] = original
+            setattr(owner, attribute, self.wrap(name, original))
+        original = SmartMoveFinder.Searcher.__dict__["search"]
+        self.originals[(SmartMoveFinder.Searcher, "search")] = original
+        SmartMoveFinder.Searcher.search = self.wrapSearch(original)
+
+    def disable(self):
+        for (owner, attribute), original in self.originals.items():
+            setattr(owner, attribute, original)
+        self.originals = {}
+
+    # Counting and timing wrapper, plus the per ply bookkeeping of the functions that have some
+    def wrap(self, name, function):
+        perf_counter = time.perf_counter
+        def wrapper(*args, **kwargs):
+            entry = self.calls.get(name)
+            if entry is None:
+                entry = self.calls[name] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[2] += 1
+            startTime = perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                entry[2] -= 1
+                if entry[2] == 0: # outermost call of a recursion, or a plain call
+                    entry[1] += perf_counter() - startTime
+            self.countPly(name, args, result)
+            return result
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    def countPly(self, name, args, result):
+        if name == "negamax": # negamax(self, gs, depth, ply, alpha, beta, pv)
+            ply = args[3]
+            self.nodesPerPly[ply] = self.nodesPerPly.get(ply, 0) + 1
+        elif name == "quiescence": # quiescence(self, gs, ply, alpha, beta)
+            ply = args[2]
+            self.quiescenceNodesPerPly[ply] = self.quiescenceNodesPerPly.get(ply, 0) + 1
+        elif name == "getValidMovesPacked": # getValidMovesPacked(self)
+            ply = len(args[0].moveLog) - self.rootPly
+            self.generationsPerPly[ply] = self.generationsPerPly.get(ply, 0) + 1
+            self.movesPerPly[ply] = self.movesPerPly.get(ply, 0) + len(result)
+        elif name == "recordCutoff": # recordCutoff(self, move, depth, ply, moveNumber)
+            ply = args[3]
+            self.cutoffsPerPly[ply] = self.cutoffsPerPly.get(ply, 0) + 1
+            if args[4] == 0:
+                self.firstMoveCutoffsPerPly[ply] = self.firstMoveCutoffsPerPly.get(ply, 0) + 1
+
+    # Searcher.search wrapper: counts start from zero for every search and end up in a report
+    def wrapSearch(self, search):
+        def wrapper(searcher, gs, validMoves=None):
+            self.reset()
+            self.rootPly = len(gs.moveLog)
+            startTime = time.perf_counter()
+            result = search(searcher, gs, validMoves)
+            report = self.report(searcher, result, time.perf_counter() - startTime)
+            self.reports.append(report)
+            if self.reportPath is not None:
+                with open(self.reportPath, "a") as reportFile:
+                    reportFile.write(json.dumps(report) + "\n")
+            return result
+        wrapper.__wrapped__ = search
+        return wrapper
+
+    # Report of the counts since the last reset, for the search that produced result
+    def report(self, searcher=None, result=None, seconds=None):
+        plies = []
+        for ply in sorted(set(self.nodesPerPly) | set(self.generationsPerPly) | set(self.quiescenceNodesPerPly)):
+            nodes = self.nodesPerPly.get(ply, 0)
+            generations = self.generationsPerPly.get(ply, 0)
+            cutoffs = self.cutoffsPerPly.get(ply, 0)
+            plies.append({
+                "ply": ply, "nodes": nodes, "quiescenceNodes": self.quiescenceNodesPerPly.get(ply, 0),
+                "legalMoves": round(self.movesPerPly.get(ply, 0) / generations, 2) if generations else 0.0,
+                # nodes searched one ply deeper per node here, the branching factor left after pruning
+                "effectiveBranching": round(self.nodesPerPly.get(ply + 1, 0) / nodes, 2) if nodes else 0.0,
+                "cutoffs": cutoffs, "cutoffRate": round(cutoffs / nodes, 3) if nodes else 0.0,
+                "firstMoveCutoffRate": round(self.firstMoveCutoffsPerPly.get(ply, 0) / cutoffs, 3) if cutoffs else 0.0})
+        report = {"calls": {name: {"calls": entry[0], "seconds": round(entry[1], 4)} for name, entry in self.calls.items()},
+                  "plies": plies}
+        if seconds is not None:
+            report["seconds"] = round(seconds, 4)
+            nodes = searcher.nodes if searcher is not None else 0
+            report["nps"] = int(nodes / seconds) if seconds > 0 else 0
+        if result is not None:
+            report.update({"bestMove": result.bestMove.getChessNotation() if result.bestMove else None,
+                           "score": result.score, "depth": result.depth,
+                           "pv": [move.getChessNotation() for move in result.pv]})
+        if searcher is not None:
+            report["searcher"] = searcher.stats()
+        return report
+
+###########################################
+# Profiling
+###########################################
+
+# Run searcher.search(gs) under cProfile. Returns (SearchResult, text of the top functions by sortBy);
+# with dumpPath the raw profile is also written there for pstats or a profile viewer.
+def profileSearch(searcher, gs, validMoves=None, top=25, sortBy="cumulative", dumpPath=None):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(searcher.search, gs, validMoves)
+    if dumpPath is not None:
+        profiler.dump_stats(dumpPath)
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats(sortBy).print_stats(top)
+    return result, text.getvalue()
+
+###########################################
+# Command Line
+###########################################
+
+def printReport(report):
+    print("%s  score %s  depth %d  %.3fs  %d nodes/s  pv %s" % (report["bestMove"], report["score"], report["depth"],
+          report["seconds"], report["nps"], " ".join(report["pv"])))
+    searcherStats = report["searcher"]
+    print("nodes %d (quiescence %d), cutoffs %d, first move cutoffs %.1f%%" % (searcherStats["nodes"],
+          searcherStats["quiescenceNodes"], searcherStats["cutoffs"], 100 * searcherStats["firstMoveCutoffRate"]))
+    print("%-20s %10s %10s %10s" % ("function", "calls", "seconds", "us/call"))
+    for name, entry in sorted(report["calls"].items(), key=lambda item: -item[1]["seconds"]):
+        print("%-20s %10d %10.3f %10.1f" % (name, entry["calls"], entry["seconds"],
+              1e6 * entry["seconds"] / entry["calls"] if entry["calls"] else 0.0))
+    print("%4s %9s %11s %7s %10s %8s %9s" % ("ply", "nodes", "quiescence", "legal", "branching", "cutoffs", "1st move"))
+    for ply in report["plies"]:
+        print("%4d %9d %11d %7.1f %10.2f %7.1f%% %8.1f%%" % (ply["ply"], ply["nodes"], ply["quiescenceNodes"], ply["legalMoves"],
+              ply["effectiveBranching"], 100 * ply["cutoffRate"], 100 * ply["firstMoveCutoffRate"]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Instrumented or profiled search of one position")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--depth", type=int, default=SmartMoveFinder.DEPTH)
+    parser.add_argument("--time", type=float, help="seconds for the search, no limit when left out")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--report-file", help="also append the report to this JSON lines file")
+    parser.add_argument("--profile", action="store_true", help="run under cProfile instead and print the hottest functions")
+    parser.add_argument("--top", type=int, default=25, help="functions listed by --profile")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key for --profile, e.g. tottime")
+    parser.add_argument("--dump", help="with --profile, write the raw profile to this file")
+    args = parser.parse_args(argv)
+
+    gs = ChessEngine.Game(fen=args.fen)
+    searcher = SmartMoveFinder.Searcher(args.depth, args.time)
+    if args.profile:
+        result, text = profileSearch(searcher, gs, top=args.top, sortBy=args.sort, dumpPath=args.dump)
+        print(result)
+        print(text)
+        return 0
+    with Instrumentation(args.report_file) as instrumentation:
+        searcher.search(gs)
+    report = instrumentation.reports[-1]
+    if args.json:
+        print(json.dumps(report))
+    else:
+        printReport(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
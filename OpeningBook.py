@@ -0,0 +1,178 @@
+'''
+OpeningBook: a read-only opening book file and the tool that builds it.
+The book is a sorted array of fixed-width big-endian records (zobrist key: 8 bytes, moveID: 2 bytes,
+weight: 2 bytes), one per position and move. A probe is a binary search over the memory-mapped file,
+so opening a book costs nothing however large it is and only the pages a probe touches are read.
+Keys are ChessEngine zobrist keys, so a book is only valid for the engine that built it.
+
+python OpeningBook.py build games.pgn book.bin                 book from the first 20 plies of every game
+python OpeningBook.py build games.pgn book.bin --plies 12 --min-games 3
+python OpeningBook.py build lines.txt book.bin --moves         one game per line, moves in SAN or coordinates
+python OpeningBook.py probe book.bin                            book moves for the start position
+python OpeningBook.py probe book.bin --fen "<fen>"
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import ChessEngine
+import PGNReplay
+
+###########################################
+# Book File
+###########################################
+
+RECORD = struct.Struct(">QHH") # zobrist key, moveID, weight
+KEY = struct.Struct(">Q")
+BOOK_PLIES = 20 # the builder only records moves this early in a game
+MIN_GAMES = 1 # moves played in fewer games than this are left out
+MAX_WEIGHT = 65535
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD.size != 0:
+            self.file.close()
+            raise ValueError("%s is not an opening book, size %d is not a multiple of %d" % (path, size, RECORD.size))
+        self.records = size // RECORD.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    # [(moveID, weight)] stored for the position with this zobrist key, an empty list when it isn't in the book
+    def probe(self, key):
+        data = self.data
+        low, high = 0, self.records
+        while low < high: # first record whose key is not below key
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.records:
+            recordKey, moveID, weight = RECORD.unpack_from(data, low * RECORD.size)
+            if recordKey != key:
+                break
+            entries.append((moveID, weight))
+            low += 1
+        return entries
+
+    # A legal book move for gs, or None when the position isn't in the book. With an rng the move is picked
+    # at random in proportion to its weight, without one the heaviest move is returned.
+    def chooseMove(self, gs, validMoves, rng=None):
+        movesByID = {move.moveID: move for move in validMoves}
+        candidates = [(movesByID[moveID], weight) for moveID, weight in self.probe(gs.zobristKey)
+                      if moveID in movesByID and weight > 0] # a key collision could point at a move that isn't legal here
+        if not candidates:
+            return None
+        if rng is None:
+            return max(candidates, key=lambda candidate: candidate[1])[0]
+        pick = rng.uniform(0, sum(weight for move, weight in candidates))
+        for move, weight in candidates:
+            pick -= weight
+            if pick <= 0:
+                return move
+        return candidates[-1][0]
+
+###########################################
+# Builder
+###########################################
+
+# Games of a file with one game per line, moves in SAN or coordinate notation separated by spaces
+def readMoveLists(listFile):
+    for line in listFile:
+        moves = [token for token in line.split() if not token.rstrip(".").isdigit() and token not in PGNReplay.RESULTS]
+        if moves:
+            yield moves
+
+def parseMove(gs, text):
+    for move in gs.getValidMoves(): # coordinate notation first, e.g. e2e4 or e7e8q
+        if move.getChessNotation() == text:
+            return move
+    return gs.parseSAN(text)
+
+# Count how often each (position, move) pair is played in the first plies of games, a list of move texts per game.
+# Returns (counts {(key, moveID): games}, games read, games cut short by an illegal move).
+def countBookMoves(games, plies=BOOK_PLIES):
+    counts = {}
+    gamesRead = rejected = 0
+    for moves in games:
+        gamesRead += 1
+        gs = ChessEngine.Game()
+        for text in moves[:plies]:
+            try:
+                move = parseMove(gs, text)
+            except ValueError:
+                rejected += 1
+                break
+            pair = (gs.zobristKey, move.moveID)
+            counts[pair] = counts.get(pair, 0) + 1
+            gs.makeMove(move)
+    return counts, gamesRead, rejected
+
+# Write the book file: records sorted by key then moveID, weights capped at MAX_WEIGHT
+def writeBook(path, counts, minGames=MIN_GAMES):
+    records = sorted((key, moveID, min(count, MAX_WEIGHT)) for (key, moveID), count in counts.items() if count >= minGames)
+    with open(path, "wb") as bookFile:
+        for record in records:
+            bookFile.write(RECORD.pack(*record))
+    return len(records)
+
+###########################################
+# Command Line
+###########################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from a PGN file or a move list file")
+    build.add_argument("games", help="PGN file, or with --moves a file with one game per line")
+    build.add_argument("book", help="book file to write")
+    build.add_argument("--moves", action="store_true", help="games are move lists, one game per line")
+    build.add_argument("--plies", type=int, default=BOOK_PLIES, help="only record this many plies of each game")
+    build.add_argument("--min-games", type=int, default=MIN_GAMES, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves for a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", default=ChessEngine.START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        with open(args.games, encoding="utf-8", errors="replace") as gamesFile:
+            if args.moves:
+                games = readMoveLists(gamesFile)
+            else:
+                games = (moves for tags, moves, result in PGNReplay.readGames(gamesFile) if "FEN" not in tags)
+            counts, gamesRead, rejected = countBookMoves(games, args.plies)
+        records = writeBook(args.book, counts, args.min_games)
+        print("%d games (%d with an illegal move), %d book entries written to %s" % (gamesRead, rejected, records, args.book))
+        return 0
+
+    book = OpeningBook(args.book)
+    try:
+        gs = ChessEngine.Game(fen=args.fen)
+        movesByID = {move.moveID: move for move in gs.getValidMoves()}
+        entries = sorted(book.probe(gs.zobristKey), key=lambda entry: -entry[1])
+        total = sum(weight for moveID, weight in entries)
+        for moveID, weight in entries:
+            move = movesByID.get(moveID)
+            print("%-8s %6d  %5.1f%%" % (gs.getSAN(move) if move else "?%d" % moveID, weight, 100.0 * weight / total))
+        if not entries:
+            print("position not in book")
+    finally:
+        book.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
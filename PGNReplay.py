@@ -0,0 +1,165 @@
+'''
+PGNReplay: plays every game of a PGN file through ChessEngine, move by move from its SAN.
+Games are read one at a time from a generator, so archives of any size replay in constant memory.
+Any game with a move the engine doesn't accept is reported, which makes this a large scale check of
+move generation and SAN handling as well as a throughput benchmark.
+
+python PGNReplay.py games.pgn                     replay everything, report illegal games and speed
+python PGNReplay.py games.pgn --max-games 10000   stop after the first 10000 games
+python PGNReplay.py games.pgn --verify-san        also check the engine writes every move the way the file does
+python PGNReplay.py games.pgn --json              machine readable report, one JSON object per line
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import json
+import re
+import sys
+import time
+import ChessEngine
+
+###########################################
+# PGN Reader
+###########################################
+
+TAG_PATTERN = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# one movetext token after optional whitespace: comment start, rest of line comment, variation start/end,
+# NAG, game result, move number, or a move
+TOKEN_PATTERN = re.compile(r"\s*(?:(\{)|(;)|(\()|(\))|(\$\d+)|(1-0|0-1|1/2-1/2|\*)|(\d+\.+)|([^\s{};()$]+))")
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# Games of a PGN file as (tags, moves, result), moves being the SAN of the main line with variations,
+# comments, NAGs and move numbers dropped. Reads the file one line at a time.
+def readGames(pgnFile):
+    tags = {}
+    moves = []
+    inComment = False # inside a { } comment, which can span lines
+    variationDepth = 0
+    for line in pgnFile:
+        if line.startswith("%"): # escape line
+            continue
+        if not inComment and variationDepth == 0 and line.lstrip().startswith("["):
+            if moves: # tags of the next game without a result token before them
+                yield tags, moves, "*"
+                tags, moves = {}, []
+            match = TAG_PATTERN.match(line.strip())
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+        position = 0
+        while position < len(line):
+            if inComment:
+                end = line.find("}", position)
+                if end < 0:
+                    break
+                inComment = False
+                position = end + 1
+                continue
+            match = TOKEN_PATTERN.match(line, position)
+            if match is None or match.end() == position:
+                break # only whitespace left
+            position = match.end()
+            comment, restOfLine, variationStart, variationEnd, nag, result, moveNumber, move = match.groups()
+            if comment:
+                inComment = True
+            elif restOfLine:
+                break
+            elif variationStart:
+                variationDepth += 1
+            elif variationEnd:
+                variationDepth = max(0, variationDepth - 1)
+            elif variationDepth > 0 or nag or moveNumber:
+                continue
+            elif result:
+                yield tags, moves, result
+                tags, moves = {}, []
+            elif move:
+                moves.append(move)
+    if moves or tags:
+        yield tags, moves, "*"
+
+###########################################
+# Replay
+###########################################
+
+# Play a game's moves from its start position (the FEN tag when there is one).
+# Returns (plies played, None) or, when a move is rejected, (plies played before it, reason).
+def replayGame(tags, moves, verifySAN=False):
+    try:
+        gs = ChessEngine.Game(fen=tags.get("FEN"))
+    except (ValueError, KeyError, IndexError) as error:
+        return 0, "bad FEN tag: %s" % error
+    for ply in range(len(moves)):
+        san = moves[ply]
+        try:
+            move = gs.parseSAN(san)
+        except ValueError as error:
+            return ply, str(error)
+        if verifySAN:
+            written = gs.getSAN(move)
+            if written != san.rstrip("!?"):
+                return ply, "engine writes %s as %s in %s" % (san, written, gs.getFEN())
+        gs.makeMove(move)
+    return len(moves), None
+
+def describeGame(number, tags):
+    return "game %d (%s - %s%s)" % (number, tags.get("White", "?"), tags.get("Black", "?"),
+                                   ", " + tags["Event"] if "Event" in tags else "")
+
+# Replay every game of pgnFile, report rejected games as they are found and return the totals
+def replayFile(pgnFile, maxGames=None, verifySAN=False, asJson=False, progressEvery=0):
+    games = plies = illegal = 0
+    startTime = time.perf_counter()
+    for tags, moves, result in readGames(pgnFile):
+        if maxGames is not None and games >= maxGames:
+            break
+        games += 1
+        played, error = replayGame(tags, moves, verifySAN)
+        plies += played
+        if error is not None:
+            illegal += 1
+            if asJson:
+                print(json.dumps({"game": games, "tags": tags, "ply": played + 1, "move": moves[played] if played < len(moves) else None,
+                                  "error": error}), flush=True)
+            else:
+                print("%s, ply %d: %s" % (describeGame(games, tags), played + 1, error), flush=True)
+        if progressEvery and games % progressEvery == 0:
+            elapsed = time.perf_counter() - startTime
+            print("%d games, %d plies, %.0f games/s" % (games, plies, games / elapsed if elapsed > 0 else 0),
+                  file=sys.stderr, flush=True)
+    elapsed = time.perf_counter() - startTime
+    return {"name": "total", "games": games, "plies": plies, "illegal": illegal, "seconds": round(elapsed, 3),
+            "gamesPerSecond": round(games / elapsed, 1) if elapsed > 0 else 0.0,
+            "pliesPerSecond": int(plies / elapsed) if elapsed > 0 else 0}
+
+###########################################
+# Command Line
+###########################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay PGN games through ChessEngine")
+    parser.add_argument("pgn", help="PGN file, - for stdin")
+    parser.add_argument("--max-games", type=int, help="stop after this many games")
+    parser.add_argument("--verify-san", action="store_true", help="also compare the engine's SAN with the file's for every move")
+    parser.add_argument("--progress", type=int, default=0, help="print progress to stderr every this many games")
+    parser.add_argument("--json", action="store_true", help="machine readable output, one JSON object per line")
+    args = parser.parse_args(argv)
+
+    pgnFile = sys.stdin if args.pgn == "-" else open(args.pgn, encoding="utf-8", errors="replace")
+    try:
+        summary = replayFile(pgnFile, args.max_games, args.verify_san, args.json, args.progress)
+    finally:
+        if pgnFile is not sys.stdin:
+            pgnFile.close()
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print("%d games, %d plies in %.2fs, %.1f games/s, %d plies/s, %d illegal" % (summary["games"], summary["plies"],
+              summary["seconds"], summary["gamesPerSecond"], summary["pliesPerSecond"], summary["illegal"]))
+    return 1 if summary["illegal"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
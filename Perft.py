@@ -0,0 +1,229 @@
+'''
+Perft: counts every leaf of the legal move tree to a fixed depth.
+It checks ChessEngine move generation against published node counts and measures how fast it runs.
+
+python Perft.py                              run the suite (positions with reference counts up to --max-nodes)
+python Perft.py --max-nodes 5000000          also run the deeper castling/enpassant/promotion traps
+python Perft.py --fen "<fen>" --depth 3      count a single position
+python Perft.py --fen "<fen>" --depth 3 --divide
+python Perft.py --json                       one JSON object per line, for tracking results between changes
+python Perft.py --stress 100000              random make/undo walks from every suite position, checking each undo
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import json
+import random
+import sys
+import time
+import ChessEngine
+
+###########################################
+# Test Positions
+###########################################
+
+# (name, FEN, {depth: published node count})
+POSITIONS = [
+    ("start", ChessEngine.START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position4-mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("illegal-enpassant-1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", {6: 1134888}),
+    ("illegal-enpassant-2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", {6: 1015133}),
+    ("enpassant-gives-check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", {6: 1440467}),
+    ("short-castle-gives-check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", {6: 661072}),
+    ("long-castle-gives-check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {6: 803711}),
+    ("castle-rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {4: 1274206}),
+    ("castle-prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {4: 1720476}),
+    # castling across squares only a pawn attacks, counted by hand
+    ("castle-through-pawn-attack-1", "r3k3/1P6/8/8/8/8/8/4K3 b q - 0 1", {1: 15}),
+    ("castle-through-pawn-attack-2", "4k3/8/8/8/8/8/6p1/4K2R w K - 0 1", {1: 13}),
+    ("castle-past-pawn-attack", "4k3/8/8/8/8/8/p7/R3K3 w Q - 0 1", {1: 10}),
+    ("promote-out-of-check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", {6: 3821001}),
+    ("discovered-check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", {5: 1004658}),
+    ("promote-to-give-check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", {6: 217342}),
+    ("underpromote-to-give-check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", {6: 92683}),
+    ("self-stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", {6: 2217}),
+    ("stalemate-and-checkmate-1", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", {7: 567584}),
+    ("stalemate-and-checkmate-2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {4: 23527}),
+]
+
+MAX_NODES = 250000 # default suite runs each position at the deepest depth whose count stays under this
+STRESS_DEPTH = 40 # deepest a random make/undo walk goes below its start position
+
+###########################################
+# Perft
+###########################################
+
+# Leaf nodes of the legal move tree depth plies below gs. The last ply is counted without playing it,
+# so its moves stay packed ints and no Move objects are built for them.
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMovesPacked()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for packed in moves:
+        gs.makeMove(ChessEngine.Move.fromPacked(packed, gs.board))
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+# Perft split by root move: [(move notation, nodes)]
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+# Everything makeMove changes, to compare a position before a move with the same position after undoMove
+def snapshot(gs):
+    return (gs.getFEN(), [[gs.board[row][col] for col in range(8)] for row in range(8)], gs.zobristKey,
+            gs.mgScore, gs.egScore, gs.phase, gs.currentCastlingRights.index(), gs.enpassantPossible,
+            gs.whiteKingLocation, gs.blackKingLocation, {piece: set(squares) for piece, squares in gs.pieceSquares.items()})
+
+# Random walk of moves and takebacks from fen until plies moves have been made, each move undone again
+# later and the position checked against a snapshot taken before the move.
+# Returns (moves made, [(fen, move notation)] of the undos that didn't restore the position).
+def stressMakeUndo(fen, plies, rng, maxDepth=STRESS_DEPTH):
+    gs = ChessEngine.Game(fen=fen)
+    snapshots = []
+    mismatches = []
+    made = 0
+    while made < plies or snapshots:
+        moves = gs.getValidMovesPacked() if made < plies and len(snapshots) < maxDepth else []
+        if moves and (not snapshots or rng.random() < 0.6): # deeper more often than not, so walks reach maxDepth
+            before = snapshot(gs)
+            gs.makeMove(ChessEngine.Move.fromPacked(rng.choice(moves), gs.board))
+            snapshots.append(before)
+            made += 1
+            continue
+        if not snapshots:
+            break
+        move = gs.moveLog[-1]
+        gs.undoMove()
+        before = snapshots.pop()
+        if snapshot(gs) != before:
+            mismatches.append((before[0], move.getChessNotation()))
+            gs = ChessEngine.Game(fen=fen) # carry on from a clean position
+            snapshots = []
+    return made, mismatches
+
+# Time one perft run and compare it with the expected count (None when there is no reference)
+def runPerft(name, fen, depth, expected):
+    gs = ChessEngine.Game(fen=fen)
+    startTime = time.perf_counter()
+    nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - startTime
+    return {"name": name, "fen": fen, "depth": depth, "nodes": nodes, "expected": expected,
+            "passed": None if expected is None else nodes == expected,
+            "seconds": round(elapsed, 4), "nps": int(nodes / elapsed) if elapsed > 0 else 0}
+
+###########################################
+# Command Line
+###########################################
+
+def printResult(result, asJson):
+    if asJson:
+        print(json.dumps(result), flush=True)
+        return
+    status = "----" if result["passed"] is None else ("ok" if result["passed"] else "FAIL")
+    expected = "" if result["expected"] is None else " (expected %d)" % result["expected"]
+    print("%-4s %-28s depth %d  %10d nodes%s  %7.2fs  %8d nodes/s" % (status, result["name"], result["depth"],
+          result["nodes"], expected, result["seconds"], result["nps"]), flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft correctness and speed checks for ChessEngine")
+    parser.add_argument("--fen", help="count this position instead of running the suite")
+    parser.add_argument("--depth", type=int, help="depth for --fen, or a fixed depth for every suite position")
+    parser.add_argument("--divide", action="store_true", help="with --fen, print the count below each root move")
+    parser.add_argument("--max-nodes", type=int, default=MAX_NODES,
+                        help="suite runs each position at its deepest reference count up to this many nodes")
+    parser.add_argument("--json", action="store_true", help="machine readable output, one JSON object per line")
+    parser.add_argument("--stress", type=int, metavar="PLIES",
+                        help="instead of perft, make and undo this many random moves from each position")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for --stress")
+    args = parser.parse_args(argv)
+
+    if args.stress:
+        rng = random.Random(args.seed)
+        positions = [("fen", args.fen)] if args.fen else [(name, fen) for name, fen, counts in POSITIONS]
+        failures = 0
+        totalMade = 0
+        totalSeconds = 0.0
+        for name, fen in positions:
+            startTime = time.perf_counter()
+            made, mismatches = stressMakeUndo(fen, args.stress, rng)
+            elapsed = time.perf_counter() - startTime
+            failures += len(mismatches)
+            totalMade += made
+            totalSeconds += elapsed
+            if args.json:
+                print(json.dumps({"name": name, "fen": fen, "moves": made, "mismatches": mismatches,
+                                  "seconds": round(elapsed, 4)}), flush=True)
+            else:
+                print("%-4s %-28s %8d moves made and undone  %7.2fs" % ("FAIL" if mismatches else "ok", name, made, elapsed), flush=True)
+                for before, notation in mismatches[:5]:
+                    print("     undo of %s from %s did not restore the position" % (notation, before))
+        if args.json:
+            print(json.dumps({"name": "total", "moves": totalMade, "seconds": round(totalSeconds, 4), "failures": failures}))
+        else:
+            print("%d moves made and undone in %.2fs, %d failed" % (totalMade, totalSeconds, failures))
+        return 1 if failures else 0
+
+    if args.fen:
+        depth = args.depth or 1
+        if args.divide:
+            gs = ChessEngine.Game(fen=args.fen)
+            total = 0
+            for notation, nodes in divide(gs, depth):
+                total += nodes
+                print(json.dumps({"move": notation, "nodes": nodes}) if args.json else "%s: %d" % (notation, nodes))
+            if not args.json:
+                print("total: %d" % total)
+            return 0
+        printResult(runPerft("fen", args.fen, depth, None), args.json)
+        return 0
+
+    failures = 0
+    totalNodes = 0
+    totalSeconds = 0.0
+    for name, fen, counts in POSITIONS:
+        if args.depth:
+            depth = args.depth
+        else:
+            depths = [depth for depth in counts if counts[depth] <= args.max_nodes]
+            if not depths:
+                continue
+            depth = max(depths)
+        result = runPerft(name, fen, depth, counts.get(depth))
+        printResult(result, args.json)
+        failures += result["passed"] is False
+        totalNodes += result["nodes"]
+        totalSeconds += result["seconds"]
+    summary = {"name": "total", "nodes": totalNodes, "seconds": round(totalSeconds, 4), "failures": failures,
+               "nps": int(totalNodes / totalSeconds) if totalSeconds > 0 else 0}
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print("%d nodes in %.2fs, %d nodes/s, %d failed" % (totalNodes, totalSeconds, summary["nps"], failures))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,27 @@
+import os
+import pickle
 import random
+import time
+import OpeningBook
+import Tablebase
+from ChessEngine import pieceScore, Move, MOVE_ENPASSANT, MOVE_ID_MASK, PROMOTION_PIECES
 
-pieceScore = {"K":0, "Q":9, "B":3, "R":5, "p":1, "N":3}
 CHECKMATE = 1000
 STALEMATE = 0
+DEPTH = 4 # deepest iteration of the iterative deepening search
+TIME_LIMIT = 3.0 # seconds the iterative deepening search may spend on a move, None for no limit
+TIME_CHECK_NODES = 512 # how often (in nodes) the search looks at the clock
+TT_SIZE_MB = 16 # memory cap for the transposition table
+MAX_PLY = 64 # deepest ply killer moves are kept for
+
+# Move ordering priorities, higher is searched first
+HASH_MOVE_ORDER = 1000000
+CAPTURE_ORDER = 100000 # plus MVV-LVA score
+KILLER_ORDER = (90000, 80000) # first and second killer of the ply
+HISTORY_MAX = 50000 # history scores are halved once any of them passes this
+DELTA_MARGIN = 2 # captures that can't lift the score to within this of alpha are skipped in quiescence
+WORKERS = os.cpu_count() or 1 # processes used by the parallel search
+ROOT_TT_SIZE_MB = 1 # table the parallel search keeps its root results in, the workers have their own full size ones
 
 def findRandomMove(validMoves):
     return validMoves[random.randint(0, len(validMoves)-1)]
@@ -43,3 +62,739 @@ def scoreMaterial(board):
             elif square[0] == "b":
                 score -= pieceScore[square[1]]
     return score
+
+###########################################
+# Transposition Table
+###########################################
+
+# Bound types of a stored score
+EXACT = 0
+LOWERBOUND = 1 # search failed high, real score is at least this
+UPPERBOUND = 2 # search failed low, real score is at most this
+MATE_BOUND = CHECKMATE - 500 # scores beyond this are mate scores, stored relative to the node
+ENTRY_BYTES = 140 # rough size of one stored entry (tuple plus its ints) used to turn megabytes into slots
+
+# Fixed number of two-slot buckets indexed by position hash. The first slot of a bucket keeps the
+# deepest search (or anything left over from an earlier search), the second slot is always replaced,
+# so deep results survive while recent shallow ones are still kept.
+# Entries are tuples (key, depth, score, bound, moveID, age).
+class TranspositionTable():
+    def __init__(self, sizeMB=TT_SIZE_MB):
+        self.sizeMB = sizeMB
+        self.buckets = max(1, int(sizeMB * 1024 * 1024) // (2 * ENTRY_BYTES))
+        self.table = [None] * (2 * self.buckets)
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.collisions = 0 # probes that found the bucket holding other positions only
+
+    def clear(self):
+        self.table = [None] * (2 * self.buckets)
+        self.age = 0
+
+    # Called once per search so entries from earlier moves of the game can give way to new ones
+    def newSearch(self):
+        self.age += 1
+
+    def probe(self, key):
+        self.probes += 1
+        index = (key % self.buckets) * 2
+        for entry in (self.table[index], self.table[index + 1]):
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry
+        if self.table[index] is not None:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, score, bound, moveID, ply):
+        self.stores += 1
+        if score >= MATE_BOUND: # mate distance from this node rather than from the root
+            score += ply
+        elif score <= -MATE_BOUND:
+            score -= ply
+        index = (key % self.buckets) * 2
+        entry = (key, depth, score, bound, moveID, self.age)
+        deepest = self.table[index]
+        if deepest is None or deepest[0] == key or depth >= deepest[1] or deepest[5] != self.age:
+            self.table[index] = entry
+        else:
+            self.table[index + 1] = entry
+
+    # Score of a probed entry as seen from a node at ply
+    def scoreAt(self, entry, ply):
+        score = entry[2]
+        if score >= MATE_BOUND:
+            return score - ply
+        if score <= -MATE_BOUND:
+            return score + ply
+        return score
+
+    def stats(self):
+        used = sum(1 for entry in self.table if entry is not None)
+        return {"sizeMB": self.sizeMB, "slots": len(self.table), "used": used, "probes": self.probes,
+                "hits": self.hits, "stores": self.stores, "collisions": self.collisions}
+
+###########################################
+# Negamax Search
+###########################################
+
+class SearchTimeout(Exception):
+    pass
+
+# What a search returns. score is from the point of view of the side to move,
+# pv is the principal variation starting with bestMove.
+class SearchResult():
+    def __init__(self, bestMove, score, pv, depth, nodes, elapsed):
+        self.bestMove = bestMove
+        self.score = score
+        self.pv = pv
+        self.depth = depth # deepest iteration that produced bestMove
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return "SearchResult(move=%s, score=%s, depth=%d, nodes=%d, time=%.2fs, pv=%s)" % (
+            self.bestMove.getChessNotation() if self.bestMove else None, self.score, self.depth,
+            self.nodes, self.elapsed, " ".join(move.getChessNotation() for move in self.pv))
+
+# SearchResult for the book move of gs (depth 0, no nodes), None when the position isn't in the book
+def probeBook(book, gs, validMoves, startTime):
+    checkmate, stalemate = gs.checkmate, gs.stalemate
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    gs.checkmate, gs.stalemate = checkmate, stalemate
+    move = book.chooseMove(gs, validMoves)
+    if move is None:
+        return None
+    return SearchResult(move, 0, [move], 0, 0, time.perf_counter() - startTime)
+
+# Exact score of a tablebase entry (result, plies) for the side to move, ply plies below the root
+def tablebaseScore(entry, ply):
+    result, plies = entry
+    if result > 0:
+        return CHECKMATE - (ply + plies)
+    if result < 0:
+        return -CHECKMATE + ply + plies
+    return STALEMATE
+
+# SearchResult for the tablebase move of gs: the fastest win, else a draw, else the slowest loss.
+# None when the position or any of its moves isn't covered by the tables.
+def probeTablebases(tablebases, gs, validMoves, startTime):
+    if tablebases.probe(gs) is None:
+        return None
+    checkmate, stalemate = gs.checkmate, gs.stalemate
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    gs.checkmate, gs.stalemate = checkmate, stalemate
+    bestMove, bestScore = None, -CHECKMATE - 1
+    for move in validMoves:
+        gs.makeMove(move)
+        try:
+            entry = tablebases.probe(gs)
+        finally:
+            gs.undoMove()
+        if entry is None:
+            return None
+        score = -tablebaseScore(entry, 1)
+        if score > bestScore:
+            bestMove, bestScore = move, score
+    if bestMove is None:
+        return None
+    return SearchResult(bestMove, bestScore, [bestMove], 0, 0, time.perf_counter() - startTime)
+
+NO_KILLERS = (None, None)
+
+# Sort packed moves in place: hash move, captures by MVV-LVA, the killers, then quiet moves by history
+def orderPackedMoves(board, moves, hashMoveID, killers, history):
+    def orderScore(packed):
+        moveID = packed & MOVE_ID_MASK
+        if moveID == hashMoveID:
+            return HASH_MOVE_ORDER
+        end = (packed >> 6) & 63
+        captured = board[end >> 3][end & 7]
+        start = packed & 63
+        moved = board[start >> 3][start & 7]
+        isPromotion = moved[1] == "p" and (end < 8 or end >= 56)
+        if captured != "--" or isPromotion or packed & MOVE_ENPASSANT:
+            # most valuable victim first, cheapest attacker breaking ties
+            victim = pieceScore[captured[1]] if captured != "--" else 0
+            if packed & MOVE_ENPASSANT:
+                victim = pieceScore["p"]
+            if isPromotion:
+                victim += pieceScore[PROMOTION_PIECES[(packed >> 12) & 3]]
+            return CAPTURE_ORDER + 10*victim - pieceScore[moved[1]]
+        if moveID == killers[0]:
+            return KILLER_ORDER[0]
+        if moveID == killers[1]:
+            return KILLER_ORDER[1]
+        return history.get(moveID, 0)
+    moves.sort(key=orderScore, reverse=True)
+
+# Sort root Move objects in place with the same ordering. Ties are broken by packed move, so the order doesn't
+# depend on the order the moves were generated in (piece square sets iterate differently in a pickled copy of
+# the game), and the serial and parallel searchers, which both use this, walk the root the same way.
+def orderRootMoves(gs, rootMoves, hashMoveID, history=None):
+    packedMoves = sorted(move.packed for move in rootMoves)
+    orderPackedMoves(gs.board, packedMoves, hashMoveID, NO_KILLERS, history if history is not None else {})
+    movesByPacked = {move.packed: move for move in rootMoves}
+    rootMoves[:] = [movesByPacked[packed] for packed in packedMoves]
+
+# Negamax with alpha-beta pruning, deepened one ply at a time until maxDepth or the time limit is reached.
+# The transposition table lives on the Searcher, so using one Searcher for a whole game lets
+# every search reuse the work of the previous ones.
+class Searcher():
+    def __init__(self, maxDepth=DEPTH, timeLimit=TIME_LIMIT, ttSizeMB=TT_SIZE_MB, useOrdering=True, book=None, tablebases=None):
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.tt = TranspositionTable(ttSizeMB)
+        self.useOrdering = useOrdering # off searches moves in generation order, for measuring the ordering
+        self.killers = [[None, None] for ply in range(MAX_PLY)] # moveIDs of quiet moves that caused cutoffs
+        self.history = {} # moveID -> how often (weighted by depth) the quiet move caused a cutoff
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0 # cutoffs caused by the first move searched, the measure of ordering quality
+        self.deadline = None
+        self.stopCondition = None # optional callable, the search gives up as soon as it returns True
+        self.onIteration = None # optional callable(depth, score, pv, nodes, seconds), told about every finished iteration
+        self.book = book # optional OpeningBook, a book move is played without searching
+        self.tablebases = tablebases # optional Tablebase.Tablebases, positions they cover are scored exactly
+        self.tablebaseHits = 0
+
+    def search(self, gs, validMoves=None):
+        startTime = time.perf_counter()
+        if self.book is not None:
+            bookResult = probeBook(self.book, gs, validMoves, startTime)
+            if bookResult is not None:
+                return bookResult
+        if self.tablebases is not None:
+            tablebaseResult = probeTablebases(self.tablebases, gs, validMoves, startTime)
+            if tablebaseResult is not None:
+                return tablebaseResult
+        self.deadline = startTime + self.timeLimit if self.timeLimit is not None else None
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.tablebaseHits = 0
+        self.tt.newSearch()
+        self.killers = [[None, None] for ply in range(MAX_PLY)]
+        for moveID in self.history: # keep what earlier searches learned, but let this one dominate
+            self.history[moveID] //= 2
+        checkmate, stalemate = gs.checkmate, gs.stalemate
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        rootMoves = list(validMoves)
+        if not rootMoves: # checkmate or stalemate, there is nothing to search
+            gs.checkmate, gs.stalemate = checkmate, stalemate
+            return SearchResult(None, -CHECKMATE if gs.inCheck() else STALEMATE, [], 0, 0, time.perf_counter() - startTime)
+        entry = self.tt.probe(gs.zobristKey)
+        if self.useOrdering:
+            orderRootMoves(gs, rootMoves, entry[4] if entry is not None else None, self.history)
+        bestMove, bestScore, bestPv, depthReached = (rootMoves[0] if rootMoves else None), 0, [], 0
+        try:
+            for depth in range(1, self.maxDepth + 1):
+                iterationMove, iterationScore, iterationPv = None, -CHECKMATE - 1, []
+                try:
+                    alpha = -CHECKMATE - 1
+                    for move in rootMoves:
+                        gs.makeMove(move)
+                        childPv = []
+                        try:
+                            score = -self.negamax(gs, depth - 1, 1, -CHECKMATE - 1, -alpha, childPv)
+                        finally:
+                            gs.undoMove()
+                        if score > iterationScore:
+                            iterationMove, iterationScore, iterationPv = move, score, [move] + childPv
+                            alpha = max(alpha, score)
+                except SearchTimeout:
+                    # The previous best move is searched first, so anything that beat it in the
+                    # unfinished iteration is still an improvement.
+                    if iterationMove is not None and iterationMove is not bestMove and iterationScore > bestScore:
+                        bestMove, bestScore, bestPv = iterationMove, iterationScore, iterationPv
+                    break
+                bestMove, bestScore, bestPv, depthReached = iterationMove, iterationScore, iterationPv, depth
+                self.tt.store(gs.zobristKey, depth, bestScore, EXACT, bestMove.moveID, 0)
+                if self.onIteration is not None:
+                    self.onIteration(depth, bestScore, bestPv, self.nodes, time.perf_counter() - startTime)
+                if abs(bestScore) >= CHECKMATE - self.maxDepth: # forced mate found, deeper won't change it
+                    break
+                rootMoves.remove(bestMove) # search the best move first in the next iteration
+                rootMoves.insert(0, bestMove)
+        finally:
+            gs.checkmate, gs.stalemate = checkmate, stalemate
+        return SearchResult(bestMove, bestScore, bestPv, depthReached, self.nodes, time.perf_counter() - startTime)
+
+    def shouldStop(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return True
+        return self.stopCondition is not None and self.stopCondition()
+
+    # Score of gs for the side to move, searched depth plies further. Fills pv with the best line.
+    def negamax(self, gs, depth, ply, alpha, beta, pv):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0 and self.shouldStop():
+            raise SearchTimeout()
+        if self.tablebases is not None:
+            entry = self.tablebases.probe(gs)
+            if entry is not None: # exact distance to mate, nothing below here needs searching
+                self.tablebaseHits += 1
+                return tablebaseScore(entry, ply)
+        if depth == 0:
+            return self.quiescence(gs, ply, alpha, beta)
+        hashMoveID = None
+        entry = self.tt.probe(gs.zobristKey)
+        if entry is not None:
+            hashMoveID = entry[4]
+            if entry[1] >= depth:
+                score = self.tt.scoreAt(entry, ply)
+                bound = entry[3]
+                if bound == EXACT or (bound == LOWERBOUND and score >= beta) or (bound == UPPERBOUND and score <= alpha):
+                    return score
+        moves = gs.getValidMovesPacked()
+        if len(moves) == 0:
+            return -CHECKMATE + ply if gs.checkmate else STALEMATE # prefer the quickest mate
+        self.orderMoves(gs.board, moves, hashMoveID, ply)
+        alphaOriginal = alpha
+        bestScore = -CHECKMATE - 1
+        bestMove = None
+        for i in range(len(moves)):
+            move = Move.fromPacked(moves[i], gs.board) # only moves that are searched get a Move object
+            gs.makeMove(move)
+            childPv = []
+            try:
+                score = -self.negamax(gs, depth - 1, ply + 1, -beta, -alpha, childPv)
+            finally:
+                gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                pv[:] = [move] + childPv
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.recordCutoff(move, depth, ply, i)
+                        break
+        if bestScore <= alphaOriginal:
+            bound = UPPERBOUND
+        elif bestScore >= beta:
+            bound = LOWERBOUND
+        else:
+            bound = EXACT
+        self.tt.store(gs.zobristKey, depth, bestScore, bound, bestMove.moveID, ply)
+        return bestScore
+
+    # Captures-only search at the leaves so a score is never taken in the middle of an exchange.
+    # The side to move may stand pat on the static score, captures that can't reach alpha (delta pruning)
+    # or that lose material by static exchange evaluation are skipped without being played.
+    # In check every evasion is searched instead, since standing pat isn't an option.
+    def quiescence(self, gs, ply, alpha, beta):
+        self.nodes += 1
+        self.quiescenceNodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0 and self.shouldStop():
+            raise SearchTimeout()
+        standPat = gs.evaluate() if gs.whiteToMove else -gs.evaluate()
+        inCheck = gs.inCheck()
+        if not inCheck:
+            if standPat >= beta or ply >= MAX_PLY:
+                return standPat
+            alpha = max(alpha, standPat)
+        moves = gs.getValidMovesPacked()
+        if len(moves) == 0:
+            return -CHECKMATE + ply if gs.checkmate else STALEMATE
+        board = gs.board
+        if not inCheck:
+            moves = [packed for packed in moves if isCaptureOrPromotion(board, packed)]
+        self.orderMoves(board, moves, None, ply if ply < MAX_PLY else MAX_PLY - 1)
+        bestScore = standPat if not inCheck else -CHECKMATE - 1
+        for packed in moves:
+            move = Move.fromPacked(packed, board)
+            if not inCheck:
+                gain = pieceScore[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+                if move.isPawnPromotion:
+                    gain += pieceScore[move.promotionPiece] - pieceScore["p"]
+                if standPat + gain + DELTA_MARGIN <= alpha:
+                    continue
+                if not move.isPawnPromotion and staticExchange(gs, move) < 0:
+                    continue
+            gs.makeMove(move)
+            try:
+                score = -self.quiescence(gs, ply + 1, -beta, -alpha)
+            finally:
+                gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return bestScore
+
+    # Sort packed moves in place: hash move, captures by MVV-LVA, killers of this ply, then quiet moves by history
+    def orderMoves(self, board, moves, hashMoveID, ply):
+        if self.useOrdering:
+            orderPackedMoves(board, moves, hashMoveID, self.killers[ply] if ply < MAX_PLY else NO_KILLERS, self.history)
+
+    # Remember quiet moves that caused a beta cutoff as killers for this ply and in the history table
+    def recordCutoff(self, move, depth, ply, moveNumber):
+        self.cutoffs += 1
+        if moveNumber == 0:
+            self.firstMoveCutoffs += 1
+        if move.pieceCaptured != "--" or move.isPawnPromotion:
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move.moveID:
+                killers[1] = killers[0]
+                killers[0] = move.moveID
+        score = self.history.get(move.moveID, 0) + depth*depth
+        self.history[move.moveID] = score
+        if score > HISTORY_MAX:
+            for moveID in self.history:
+                self.history[moveID] //= 2
+
+    def stats(self):
+        return {"nodes": self.nodes, "quiescenceNodes": self.quiescenceNodes, "cutoffs": self.cutoffs, "firstMoveCutoffs": self.firstMoveCutoffs,
+                "firstMoveCutoffRate": self.firstMoveCutoffs / self.cutoffs if self.cutoffs else 0.0,
+                "tt": self.tt.stats()}
+
+###########################################
+# Static Exchange Evaluation
+###########################################
+
+# Packed moves quiescence keeps: captures, en passant and promotions
+def isCaptureOrPromotion(board, packed):
+    end = (packed >> 6) & 63
+    if board[end >> 3][end & 7] != "--" or packed & MOVE_ENPASSANT:
+        return True
+    start = packed & 63
+    return board[start >> 3][start & 7][1] == "p" and (end < 8 or end >= 56)
+
+KING_EXCHANGE_VALUE = 100 # the king only joins an exchange last, when nothing can recapture it
+
+# Material the side making the capture move nets once both sides have traded off every attacker of the
+# target square, cheapest attacker first, each side free to stop when continuing would lose.
+# Pieces are lifted off the board as they capture, so sliders lined up behind them join in,
+# and the board is put back before returning. Nothing is played with makeMove.
+def staticExchange(gs, move):
+    if move.isEnpassantMove:
+        return pieceScore["p"]
+    board = gs.board
+    row, col = move.endRow, move.endCol
+    gains = [pieceScore[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0]
+    onSquare = move.pieceMoved # piece that would be captured next
+    lifted = [(move.startRow, move.startCol, move.pieceMoved)]
+    board[move.startRow][move.startCol] = "--"
+    color = "b" if move.pieceMoved[0] == "w" else "w"
+    try:
+        while True:
+            attackers = gs.getAttackers(row, col, color)
+            if len(attackers) == 0:
+                break
+            attackerRow, attackerCol = min(attackers, key=lambda square: exchangeValue(board[square[0]][square[1]]))
+            attacker = board[attackerRow][attackerCol]
+            if attacker[1] == "K" and len(gs.getAttackers(row, col, "b" if color == "w" else "w")) > 0:
+                break # the king can't capture into a defended square
+            gains.append(pieceScore[onSquare[1]] - gains[-1])
+            lifted.append((attackerRow, attackerCol, attacker))
+            board[attackerRow][attackerCol] = "--"
+            onSquare = attacker
+            color = "b" if color == "w" else "w"
+    finally:
+        for liftedRow, liftedCol, piece in reversed(lifted):
+            board[liftedRow][liftedCol] = piece
+    # gains[i] is the score for the side making capture i if the exchange stopped right after it,
+    # each side takes the better of stopping or carrying on
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+def exchangeValue(piece):
+    return KING_EXCHANGE_VALUE if piece[1] == "K" else pieceScore[piece[1]]
+
+searcher = None # shared by findBestMoveIterative so its transposition table carries over between moves
+
+# Best move by iterative deepening negamax, stopping at maxDepth plies or after timeLimit seconds
+def findBestMoveIterative(gs, validMoves, maxDepth=DEPTH, timeLimit=TIME_LIMIT):
+    global searcher
+    if searcher is None:
+        searcher = Searcher(maxDepth, timeLimit)
+    searcher.maxDepth = maxDepth
+    searcher.timeLimit = timeLimit
+    return searcher.search(gs, validMoves)
+
+###########################################
+# Parallel Search
+###########################################
+
+# Root moves of each iteration are shared out over a pool of worker processes. Every worker keeps its own
+# copy of the game and its own Searcher (so its transposition table, killers and history carry over
+# between tasks), and all of them read and raise one shared alpha, so a good score found by one worker
+# narrows the window of every root move searched after it. With one worker the root moves are searched
+# one after another in order, so the result is deterministic.
+class ParallelSearcher():
+    def __init__(self, workers=WORKERS, maxDepth=DEPTH, timeLimit=TIME_LIMIT, ttSizeMB=TT_SIZE_MB, book=None):
+        self.workers = workers
+        self.book = book
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.tt = TranspositionTable(ROOT_TT_SIZE_MB) # root positions only, for the hash move of the next search
+        import multiprocessing # only imported by the searches that need it, it is most of this module's import time
+        self.sharedAlpha = multiprocessing.Value("d", -CHECKMATE - 1)
+        self.pool = multiprocessing.Pool(workers, initializer=initParallelWorker,
+                                         initargs=(self.sharedAlpha, ttSizeMB))
+        self.nodes = 0
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def search(self, gs, validMoves=None):
+        startTime = time.perf_counter()
+        if self.book is not None:
+            bookResult = probeBook(self.book, gs, validMoves, startTime)
+            if bookResult is not None:
+                return bookResult
+        deadline = time.time() + self.timeLimit if self.timeLimit is not None else None
+        self.nodes = 0
+        checkmate, stalemate = gs.checkmate, gs.stalemate
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        gs.checkmate, gs.stalemate = checkmate, stalemate
+        rootMoves = list(validMoves)
+        if not rootMoves:
+            return SearchResult(None, -CHECKMATE if gs.inCheck() else STALEMATE, [], 0, 0, time.perf_counter() - startTime)
+        self.tt.newSearch()
+        entry = self.tt.probe(gs.zobristKey)
+        orderRootMoves(gs, rootMoves, entry[4] if entry is not None else None) # the history tables are in the workers
+        gamePayload = pickle.dumps(gs)
+        bestMove, bestScore, bestPv, depthReached = (rootMoves[0] if rootMoves else None), 0, [], 0
+        for depth in range(1, self.maxDepth + 1):
+            if not rootMoves:
+                break
+            self.sharedAlpha.value = -CHECKMATE - 1
+            tasks = [(gamePayload, gs.zobristKey, move.moveID, depth, deadline) for move in rootMoves]
+            results = self.pool.map(searchRootMove, tasks, chunksize=1)
+            iterationMove, iterationScore, iterationPv = None, -CHECKMATE - 1, []
+            completed = True
+            for move, (score, exact, pv, nodes) in zip(rootMoves, results):
+                self.nodes += nodes
+                if score is None:
+                    completed = False
+                elif exact and score > iterationScore: # fail-low scores are only bounds
+                    iterationMove, iterationScore, iterationPv = move, score, [move] + pv
+            if not completed:
+                # same rule as the serial search: keep the finished iteration unless the previous best
+                # move was searched to this depth and something beat it
+                if iterationMove is not None and iterationMove is not bestMove and iterationScore > bestScore \
+                        and results[0][0] is not None:
+                    bestMove, bestScore, bestPv = iterationMove, iterationScore, iterationPv
+                break
+            bestMove, bestScore, bestPv, depthReached = iterationMove, iterationScore, iterationPv, depth
+            self.tt.store(gs.zobristKey, depth, bestScore, EXACT, bestMove.moveID, 0)
+            if abs(bestScore) >= CHECKMATE - self.maxDepth:
+                break
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0, bestMove)
+        return SearchResult(bestMove, bestScore, bestPv, depthReached, self.nodes, time.perf_counter() - startTime)
+
+parallelSharedAlpha = None # worker process state, set up by initParallelWorker
+parallelSearcher = None
+parallelGame = None
+parallelGameKey = None
+
+def initParallelWorker(sharedAlpha, ttSizeMB):
+    global parallelSharedAlpha, parallelSearcher
+    parallelSharedAlpha = sharedAlpha
+    parallelSearcher = Searcher(DEPTH, None, ttSizeMB)
+
+# Search one root move in a worker. Returns (score, exact, pv after the move, nodes), score None on timeout.
+def searchRootMove(task):
+    global parallelGame, parallelGameKey
+    gamePayload, key, moveID, depth, deadline = task
+    if parallelGameKey != (key, gamePayload):
+        parallelGame = pickle.loads(gamePayload)
+        parallelGameKey = (key, gamePayload)
+        parallelSearcher.tt.newSearch()
+    gs = parallelGame
+    searcher = parallelSearcher
+    searcher.nodes = 0
+    searcher.deadline = time.perf_counter() + (deadline - time.time()) if deadline is not None else None
+    move = [move for move in gs.getValidMoves() if move.moveID == moveID][0]
+    alpha = parallelSharedAlpha.value
+    pv = []
+    gs.makeMove(move)
+    try:
+        score = -searcher.negamax(gs, depth - 1, 1, -CHECKMATE - 1, -alpha, pv)
+    except SearchTimeout:
+        return None, False, [], searcher.nodes
+    finally:
+        gs.undoMove()
+    with parallelSharedAlpha.get_lock():
+        if score > parallelSharedAlpha.value:
+            parallelSharedAlpha.value = score
+    return score, score > alpha, pv, searcher.nodes
+
+# Time a fixed depth search with each worker count and print the speedup over one worker
+def benchmarkParallel(gs, depth, workerCounts):
+    baseTime = None
+    rows = []
+    for workers in workerCounts:
+        searcher = ParallelSearcher(workers, depth, None)
+        try:
+            result = searcher.search(gs)
+        finally:
+            searcher.close()
+        if baseTime is None:
+            baseTime = result.elapsed
+        row = {"workers": workers, "seconds": round(result.elapsed, 3), "nodes": result.nodes,
+               "speedup": round(baseTime / result.elapsed, 2) if result.elapsed > 0 else 0.0,
+               "move": result.bestMove.getChessNotation() if result.bestMove else None, "score": result.score}
+        print("%2d workers  %7.2fs  %8d nodes  speedup %.2fx  best %s (%s)" % (workers, row["seconds"], row["nodes"],
+              row["speedup"], row["move"], row["score"]), flush=True)
+        rows.append(row)
+    return rows
+
+###########################################
+# Background Search
+###########################################
+
+PONDER_DEPTH = DEPTH + 2 # pondering has no clock, it runs to this depth or until it is cancelled or hit
+
+# Runs searches in a separate process so the caller (the pygame loop) never waits on the engine.
+# The worker keeps one Searcher for its whole life, so its transposition table carries over between
+# moves. A ponder search on the predicted reply becomes the real search when that reply is played (a ponder
+# hit): it gets the normal time limit from then on and its answer is collected like any other.
+# Every search gets an id, and a search stops as soon as the shared current id moves past it.
+class BackgroundSearch():
+    def __init__(self, maxDepth=DEPTH, timeLimit=TIME_LIMIT, ttSizeMB=TT_SIZE_MB, bookPath=None, tablebaseDir=None):
+        import multiprocessing
+        self.currentId = multiprocessing.Value("i", 0)
+        self.ponderHitId = multiprocessing.Value("i", 0) # id of the ponder search that was hit, its answer is wanted
+        self.commands = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=backgroundSearchWorker, daemon=True,
+                                               args=(self.commands, self.results, self.currentId, self.ponderHitId, maxDepth,
+                                                     timeLimit, ttSizeMB, bookPath, tablebaseDir))
+        self.process.start()
+        self.searching = False
+        self.ponderMoveID = None # moveID of the reply being pondered on, None when not pondering
+        self.predictedMoveID = None # reply the last finished search expects, second move of its pv
+
+    # Start looking for a move in gs, the answer is collected with pollMove
+    def start(self, gs):
+        self.ponderMoveID = None
+        self.searching = True
+        self.send("search", gs)
+
+    # Think on the opponent's time, assuming they reply with predictedMove
+    def ponder(self, gs, predictedMove):
+        gs.makeMove(predictedMove)
+        try:
+            self.send("ponder", gs)
+        finally:
+            gs.undoMove()
+        self.ponderMoveID = predictedMove.moveID
+
+    # Call when the opponent plays move. If it is the reply being pondered on, the ponder search carries on as the
+    # search for the AI's answer (collected with pollMove) and True is returned; otherwise start a new search.
+    def ponderHit(self, move):
+        if self.ponderMoveID is None or move.moveID != self.ponderMoveID:
+            return False
+        self.ponderHitId.value = self.currentId.value
+        self.ponderMoveID = None
+        self.searching = True
+        return True
+
+    # Stop whatever the worker is searching and drop any answer still on its way
+    def cancel(self):
+        with self.currentId.get_lock():
+            self.currentId.value += 1
+        self.searching = False
+        self.ponderMoveID = None
+
+    # The SearchResult of the running search once it is done (bestMove None when there were no legal moves),
+    # otherwise None. Never blocks.
+    def pollMove(self, validMoves):
+        while not self.results.empty():
+            searchId, moveID, pvIDs, score, depth, nodes, elapsed = self.results.get()
+            if searchId != self.currentId.value or not self.searching:
+                continue # answer to a cancelled search
+            self.searching = False
+            self.predictedMoveID = pvIDs[1] if len(pvIDs) > 1 else None
+            if moveID is None: # no legal moves in the searched position
+                return SearchResult(None, score, [], depth, nodes, elapsed)
+            bestMove = None
+            for move in validMoves:
+                if move.moveID == moveID:
+                    bestMove = move
+            if bestMove is None:
+                return None
+            return SearchResult(bestMove, score, [bestMove], depth, nodes, elapsed)
+        return None
+
+    def send(self, mode, gs):
+        with self.currentId.get_lock(): # a new search cancels the previous one
+            self.currentId.value += 1
+            searchId = self.currentId.value
+        # pickled here rather than by the queue's feeder thread, which could see the game after it changes
+        self.commands.put((searchId, mode, pickle.dumps(gs)))
+
+    def close(self):
+        self.cancel()
+        self.commands.put(None)
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+def backgroundSearchWorker(commands, results, currentId, ponderHitId, maxDepth, timeLimit, ttSizeMB, bookPath=None,
+                           tablebaseDir=None):
+    book = None
+    if bookPath is not None:
+        book = OpeningBook.OpeningBook(bookPath) # the worker maps the book itself, a mapped file can't be sent to another process
+    tablebases = Tablebase.Tablebases(tablebaseDir) if tablebaseDir is not None else None
+    searcher = Searcher(maxDepth, timeLimit, ttSizeMB, book=book, tablebases=tablebases)
+    while True:
+        command = commands.get()
+        if command is None:
+            return
+        searchId, mode, gamePayload = command
+        if searchId != currentId.value:
+            continue # superseded before it started
+        gs = pickle.loads(gamePayload)
+        if mode == "ponder":
+            searcher.maxDepth, searcher.timeLimit = PONDER_DEPTH, None
+            searcher.stopCondition = ponderStopCondition(currentId, ponderHitId, searchId, timeLimit)
+        else:
+            searcher.maxDepth, searcher.timeLimit = maxDepth, timeLimit
+            searcher.stopCondition = lambda: currentId.value != searchId
+        # Ponder answers are posted too: BackgroundSearch only collects one after a ponder hit, and drops it
+        # as stale once another search has started.
+        result = searcher.search(gs)
+        results.put((searchId, result.bestMove.moveID if result.bestMove is not None else None,
+                     [move.moveID for move in result.pv], result.score, result.depth, result.nodes, result.elapsed))
+
+# Stop condition of a ponder search: cancelled, or timeLimit seconds gone since the ponder hit
+def ponderStopCondition(currentId, ponderHitId, searchId, timeLimit):
+    hitTime = []
+    def stopCondition():
+        if currentId.value != searchId:
+            return True
+        if timeLimit is None or ponderHitId.value != searchId:
+            return False
+        if not hitTime:
+            hitTime.append(time.perf_counter())
+        return time.perf_counter() - hitTime[0] > timeLimit
+    return stopCondition
+
+if __name__ == "__main__":
+    import argparse
+    import ChessEngine
+    parser = argparse.ArgumentParser(description="Parallel search speedup versus worker count")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN)
+    parser.add_argument("--depth", type=int, default=DEPTH)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts to compare")
+    args = parser.parse_args()
+    benchmarkParallel(ChessEngine.Game(fen=args.fen), args.depth, [int(n) for n in args.workers.split(",")])
@@ -0,0 +1,518 @@
+'''
+Tablebase: distance to mate tables for endgames with up to 4 pieces, built by retrograde analysis.
+A table covers one material set, named white pieces then black pieces ("KQK", "KRKN", "KPK"), with either
+side to move. It is a flat array of one byte per position, indexed by a perfect index over the piece
+squares after folding the board by symmetry, and saved as-is (array tofile). Positions with the colors
+reversed are probed by mirroring the board, so KQK also answers for a black queen.
+
+python Tablebase.py generate KQK KRK                   build tables, plus any smaller table they capture into
+python Tablebase.py generate KQKR --workers 4          spread the work over 4 processes
+python Tablebase.py probe --fen "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+
+Castling and enpassant are left out: generation plays neither, and probe answers None for a position
+where either is still possible.
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import array
+import os
+import sys
+import time
+import ChessEngine
+from ChessEngine import KING_TARGETS, KNIGHT_TARGETS, RAY_TARGETS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS, QUEEN_DIRECTIONS, PROMOTION_PIECES
+
+###########################################
+# Values
+###########################################
+
+# One byte per position, from the side to move's point of view:
+# 0 draw, odd n a win (mate in n plies), even n >= 2 a loss (mated in n - 2 plies), ILLEGAL not a position
+DRAW = 0
+MATED = 2
+ILLEGAL = 255
+MAX_PIECES = 4
+TABLEBASE_DIR = "tablebases"
+PIECE_ORDER = "QRBNP" # non-king pieces, strongest first, the order they are named in a material set
+DRAWN_MATERIAL = ("KK", "KBK", "KNK", "KKB", "KKN") # nobody can be mated, no table needed
+
+# (result, plies) for a table value: result 1 win, 0 draw, -1 loss for the side to move
+def valueResult(value):
+    if value == DRAW:
+        return 0, 0
+    if value & 1:
+        return 1, value
+    return -1, value - MATED
+
+###########################################
+# Material Sets and Indexing
+###########################################
+
+# Board symmetries as square maps, sq = row*8 + col. Without pawns all 8 rotations and reflections keep
+# the game the same, with pawns only the left-right mirror does.
+def buildTransforms(withDiagonals):
+    transforms = []
+    for transpose in ((False, True) if withDiagonals else (False,)):
+        for flipRows in ((False, True) if withDiagonals else (False,)):
+            for flipCols in (False, True):
+                transform = []
+                for sq in range(64):
+                    row, col = sq >> 3, sq & 7
+                    if transpose:
+                        row, col = col, row
+                    if flipRows:
+                        row = 7 - row
+                    if flipCols:
+                        col = 7 - col
+                    transform.append(row*8 + col)
+                transforms.append(tuple(transform))
+    return transforms
+
+PAWNLESS_TRANSFORMS = buildTransforms(True)
+PAWN_TRANSFORMS = buildTransforms(False)
+# squares the white king is folded into: the a1-d1-d4 triangle without pawns, files a-d with them
+PAWNLESS_KING_SQUARES = [sq for sq in range(64) if (sq & 7) <= 3 and 7 - (sq >> 3) <= (sq & 7)]
+PAWN_KING_SQUARES = [sq for sq in range(64) if (sq & 7) <= 3]
+
+# Split "KQKR" into ("KQ", "KR"), raising ValueError for anything that isn't a material set
+def splitMaterial(material):
+    if material.count("K") != 2 or not material.startswith("K") or any(char not in "K" + PIECE_ORDER for char in material):
+        raise ValueError("material set must look like KQK or KRKN, got %s" % material)
+    second = material.index("K", 1)
+    return material[:second], material[second:]
+
+def sortSide(side):
+    return "K" + "".join(sorted(side[1:], key=PIECE_ORDER.index))
+
+# The name a table is stored under: each side's pieces in PIECE_ORDER, stronger side as white
+def canonicalMaterial(material):
+    white, black = splitMaterial(material)
+    white, black = sortSide(white), sortSide(black)
+    strength = lambda side: (len(side), [-PIECE_ORDER.index(piece) for piece in side[1:]])
+    if strength(black) > strength(white):
+        white, black = black, white
+    return white + black
+
+def colorFlip(material):
+    white, black = splitMaterial(material)
+    return black + white
+
+class Material():
+    def __init__(self, material):
+        self.name = material
+        white, black = splitMaterial(material)
+        if len(material) > MAX_PIECES:
+            raise ValueError("tables go up to %d pieces, %s has %d" % (MAX_PIECES, material, len(material)))
+        # board pieces in index order, white king first
+        self.pieces = [("w" if i < len(white) else "b") + (char if char != "P" else "p") for i, char in enumerate(white + black)]
+        self.hasPawns = "P" in material
+        self.transforms = PAWN_TRANSFORMS if self.hasPawns else PAWNLESS_TRANSFORMS
+        self.kingSquares = PAWN_KING_SQUARES if self.hasPawns else PAWNLESS_KING_SQUARES
+        self.kingSlot = [-1] * 64
+        for slot, sq in enumerate(self.kingSquares):
+            self.kingSlot[sq] = slot
+        self.size = 2 * len(self.kingSquares) * 64 ** (len(self.pieces) - 1)
+        # runs of identical pieces, their squares are kept sorted so each position has one index
+        self.identicalRuns = []
+        start = 0
+        for i in range(1, len(self.pieces) + 1):
+            if i == len(self.pieces) or self.pieces[i] != self.pieces[start]:
+                if i - start > 1:
+                    self.identicalRuns.append((start, i))
+                start = i
+
+    # Index of the position with the pieces on squares (in self.pieces order). Every symmetric copy of
+    # a position gets the same index, the smallest one among the symmetries that fold the white king.
+    def index(self, squares, whiteToMove):
+        best = None
+        for transform in self.transforms:
+            slot = self.kingSlot[transform[squares[0]]]
+            if slot < 0:
+                continue
+            mapped = [transform[sq] for sq in squares]
+            for start, end in self.identicalRuns:
+                mapped[start:end] = sorted(mapped[start:end])
+            index = (0 if whiteToMove else 1) * len(self.kingSquares) + slot
+            for sq in mapped[1:]:
+                index = index*64 + sq
+            if best is None or index < best:
+                best = index
+        return best
+
+    # (squares, whiteToMove) of an index, the inverse of index for folded positions
+    def decode(self, index):
+        squares = []
+        for i in range(len(self.pieces) - 1):
+            squares.append(index & 63)
+            index >>= 6
+        squares.append(self.kingSquares[index % len(self.kingSquares)])
+        squares.reverse()
+        return squares, index // len(self.kingSquares) == 0
+
+###########################################
+# Probing
+###########################################
+
+# Loads tables from a directory as they are needed and answers probes for positions with few enough pieces
+class Tablebases():
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {} # material name -> (Material, values), None when there is no file for it
+        self.maxPieces = MAX_PIECES
+
+    def path(self, material):
+        return os.path.join(self.directory, material + ".tb")
+
+    def loadTable(self, material):
+        if material not in self.tables:
+            path = self.path(material)
+            if not os.path.exists(path):
+                self.tables[material] = None
+            else:
+                spec = Material(material)
+                values = array.array("B")
+                with open(path, "rb") as tableFile:
+                    values.fromfile(tableFile, os.path.getsize(path))
+                if len(values) != spec.size:
+                    raise ValueError("%s has %d positions, %s needs %d" % (path, len(values), material, spec.size))
+                self.tables[material] = (spec, values)
+        return self.tables[material]
+
+    def has(self, material):
+        if material in DRAWN_MATERIAL:
+            return True
+        return self.loadTable(material) is not None or self.loadTable(colorFlip(material)) is not None
+
+    # Table value of a position given as board pieces ("wK", "bp", ...) on squares, None if no table covers it
+    def probePieces(self, pieces, squares, whiteToMove):
+        white = sorted((piece[1].upper(), sq) for piece, sq in zip(pieces, squares) if piece[0] == "w")
+        black = sorted((piece[1].upper(), sq) for piece, sq in zip(pieces, squares) if piece[0] == "b")
+        rank = lambda entry: ("K" + PIECE_ORDER).index(entry[0])
+        white.sort(key=rank)
+        black.sort(key=rank)
+        material = "".join(piece for piece, sq in white) + "".join(piece for piece, sq in black)
+        if material in DRAWN_MATERIAL:
+            return DRAW
+        table = self.loadTable(material)
+        if table is not None:
+            spec, values = table
+            return values[spec.index([sq for piece, sq in white + black], whiteToMove)]
+        table = self.loadTable(colorFlip(material))
+        if table is not None: # same table with the board mirrored top to bottom and the colors swapped
+            spec, values = table
+            return values[spec.index([sq ^ 56 for piece, sq in black + white], not whiteToMove)]
+        return None
+
+    # (result, plies) for the side to move in gs (result 1 win, 0 draw, -1 loss, plies to mate), or None
+    # when gs has too many pieces, no table covers it, or castling or an enpassant capture is still possible
+    def probe(self, gs):
+        if sum(len(pieceSquares) for pieceSquares in gs.pieceSquares.values()) > self.maxPieces or gs.currentCastlingRights.index():
+            return None
+        if gs.enpassantPossible: # only matters when a pawn can actually take enpassant
+            row, col = gs.enpassantPossible
+            pawnRow = row + 1 if gs.whiteToMove else row - 1
+            pawn = ("w" if gs.whiteToMove else "b") + "p"
+            if any(0 <= pawnCol < 8 and gs.board[pawnRow][pawnCol] == pawn for pawnCol in (col - 1, col + 1)):
+                return None
+        pieces = []
+        squares = []
+        for piece, pieceSquares in gs.pieceSquares.items():
+            for sq in pieceSquares:
+                pieces.append(piece)
+                squares.append(sq)
+        value = self.probePieces(pieces, squares, gs.whiteToMove)
+        if value is None or value == ILLEGAL:
+            return None
+        return valueResult(value)
+
+###########################################
+# Generation
+###########################################
+
+# Per process state of the generator, set up by initGenerator
+generatorSpec = None
+generatorTablebases = None
+generatorGame = None
+
+def initGenerator(material, directory):
+    global generatorSpec, generatorTablebases, generatorGame
+    generatorSpec = Material(material)
+    generatorTablebases = Tablebases(directory)
+    generatorGame = ChessEngine.Game(fen="k7/8/8/8/8/8/8/K7 w - - 0 1")
+    for piece in ("wK", "bK"): # start from an empty board, every piece is placed per position
+        for sq in list(generatorGame.pieceSquares[piece]):
+            generatorGame.board[sq >> 3][sq & 7] = "--"
+            generatorGame.pieceSquares[piece].discard(sq)
+
+def placePieces(gs, pieces, squares, whiteToMove):
+    for piece, sq in zip(pieces, squares):
+        gs.board[sq >> 3][sq & 7] = piece
+        gs.pieceSquares[piece].add(sq)
+        if piece == "wK":
+            gs.whiteKingLocation = (sq >> 3, sq & 7)
+        elif piece == "bK":
+            gs.blackKingLocation = (sq >> 3, sq & 7)
+    gs.whiteToMove = whiteToMove
+
+def clearPieces(gs, pieces, squares):
+    for piece, sq in zip(pieces, squares):
+        gs.board[sq >> 3][sq & 7] = "--"
+        gs.pieceSquares[piece].discard(sq)
+
+# First pass over indexes start..end with the engine's move generator. For each position returns
+#   value: ILLEGAL, MATED, DRAW for stalemate, otherwise DRAW (not known yet)
+#   children: how many different positions of this table the legal moves lead to
+#   exitWin: fastest win through a capture or promotion (plies), 0 if none
+#   exitLoss: slowest loss through a capture or promotion (plies), 0 if none
+#   exitDraw: 1 when some capture or promotion draws
+def scanPositions(bounds):
+    start, end = bounds
+    spec, tablebases, gs = generatorSpec, generatorTablebases, generatorGame
+    pieces = spec.pieces
+    values = array.array("B", bytes(end - start))
+    children = array.array("B", bytes(end - start))
+    exitWin = array.array("B", bytes(end - start))
+    exitLoss = array.array("B", bytes(end - start))
+    exitDraw = array.array("B", bytes(end - start))
+    for index in range(start, end):
+        i = index - start
+        squares, whiteToMove = spec.decode(index)
+        if len(set(squares)) != len(squares) or spec.index(squares, whiteToMove) != index or any(
+                piece[1] == "p" and (sq < 8 or sq >= 56) for piece, sq in zip(pieces, squares)):
+            values[i] = ILLEGAL
+            continue
+        placePieces(gs, pieces, squares, whiteToMove)
+        try:
+            otherKing = gs.blackKingLocation if whiteToMove else gs.whiteKingLocation
+            if gs.getAttackers(otherKing[0], otherKing[1], "w" if whiteToMove else "b", firstOnly=True):
+                values[i] = ILLEGAL # the side that just moved left its king in check
+                continue
+            moves = gs.getValidMovesPacked()
+            if not moves:
+                values[i] = MATED if gs.inCheck() else DRAW
+                continue
+            inTable = set()
+            for packed in moves:
+                moveStart = packed & 63
+                moveEnd = (packed >> 6) & 63
+                slot = squares.index(moveStart)
+                childSquares = list(squares)
+                childSquares[slot] = moveEnd
+                captured = squares.index(moveEnd) if moveEnd in squares else None
+                promoted = pieces[slot][1] == "p" and (moveEnd < 8 or moveEnd >= 56)
+                if captured is None and not promoted:
+                    inTable.add(spec.index(childSquares, not whiteToMove))
+                    continue
+                childPieces = list(pieces)
+                if promoted:
+                    childPieces[slot] = pieces[slot][0] + PROMOTION_PIECES[(packed >> 12) & 3]
+                if captured is not None:
+                    del childPieces[captured]
+                    del childSquares[captured]
+                childValue = tablebases.probePieces(childPieces, childSquares, not whiteToMove)
+                if childValue is None:
+                    raise ValueError("%s captures or promotes into a position with no table" % spec.name)
+                result, plies = valueResult(childValue)
+                if result < 0: # opponent gets mated, a win for the side to move
+                    if exitWin[i] == 0 or plies + 1 < exitWin[i]:
+                        exitWin[i] = plies + 1
+                elif result > 0:
+                    exitLoss[i] = max(exitLoss[i], plies + 1)
+                else:
+                    exitDraw[i] = 1
+            children[i] = len(inTable)
+        finally:
+            clearPieces(gs, pieces, squares)
+    return start, values.tobytes(), children.tobytes(), exitWin.tobytes(), exitLoss.tobytes(), exitDraw.tobytes()
+
+# Indexes of the positions one move before index, found by taking back a non-capturing move of the side
+# that isn't to move. Captures and promotions lead out of the table, so they are never taken back.
+def predecessors(index):
+    spec = generatorSpec
+    squares, whiteToMove = spec.decode(index)
+    occupied = set(squares)
+    moverColor = "b" if whiteToMove else "w" # the side that made the last move
+    found = set()
+    for slot, piece in enumerate(spec.pieces):
+        if piece[0] != moverColor:
+            continue
+        sq = squares[slot]
+        origins = []
+        pieceType = piece[1]
+        if pieceType == "K":
+            origins = [endSq for endRow, endCol, endSq in KING_TARGETS[sq] if endSq not in occupied]
+        elif pieceType == "N":
+            origins = [endSq for endRow, endCol, endSq in KNIGHT_TARGETS[sq] if endSq not in occupied]
+        elif pieceType == "p":
+            step = 8 if moverColor == "w" else -8 # back down the board for white, back up for black
+            origin = sq + step
+            if 8 <= origin < 56 and origin not in occupied:
+                origins.append(origin)
+                if (sq >> 3) == (4 if moverColor == "w" else 3) and origin + step not in occupied:
+                    origins.append(origin + step) # double push from the starting rank
+        else:
+            directions = ROOK_DIRECTIONS if pieceType == "R" else BISHOP_DIRECTIONS if pieceType == "B" else QUEEN_DIRECTIONS
+            for direction in directions:
+                for endRow, endCol, endSq in RAY_TARGETS[sq][direction]:
+                    if endSq in occupied:
+                        break
+                    origins.append(endSq)
+        for origin in origins:
+            previous = list(squares)
+            previous[slot] = origin
+            found.add(spec.index(previous, not whiteToMove))
+    return index, list(found)
+
+# Build the table for material and save it in directory. Smaller tables that captures and promotions lead to
+# have to exist already (generateWithDependencies builds them first). Returns (positions, seconds).
+def generateTable(material, directory=TABLEBASE_DIR, workers=1, log=None):
+    startTime = time.perf_counter()
+    spec = Material(material)
+    size = spec.size
+    values = array.array("B", bytes(size))
+    children = array.array("B", bytes(size))
+    exitWin = array.array("B", bytes(size))
+    exitLoss = array.array("B", bytes(size))
+    exitDraw = array.array("B", bytes(size))
+    chunk = max(1024, size // (workers * 16))
+    import multiprocessing # here rather than at the top, so probing the tables doesn't pay for importing it
+    bounds = [(start, min(start + chunk, size)) for start in range(0, size, chunk)]
+    pool = multiprocessing.Pool(workers, initializer=initGenerator, initargs=(material, directory)) if workers > 1 else None
+    if pool is None:
+        initGenerator(material, directory)
+    mapper = pool.imap_unordered if pool is not None else map
+    try:
+        for start, *parts in mapper(scanPositions, bounds):
+            for target, part in zip((values, children, exitWin, exitLoss, exitDraw), parts):
+                target[start:start + len(part)] = array.array("B", part)
+        if log:
+            log("%s: %d positions scanned in %.1fs" % (material, size, time.perf_counter() - startTime))
+
+        # Retrograde pass, one distance at a time. frontier[plies] holds the positions whose value was settled
+        # as mate in plies (for either side), pending[plies] values coming from captures and promotions that
+        # become true at that distance unless something faster was found first.
+        frontier = {MATED - 2: [index for index in range(size) if values[index] == MATED]}
+        pending = {}
+        for index in range(size):
+            if values[index] != DRAW:
+                continue
+            if exitWin[index]:
+                pending.setdefault(exitWin[index], []).append((index, exitWin[index]))
+            elif children[index] == 0 and exitLoss[index] and not exitDraw[index]: # every move leaves the table and loses
+                pending.setdefault(exitLoss[index], []).append((index, exitLoss[index] + MATED))
+        plies = 0
+        while plies in frontier or any(distance >= plies for distance in pending):
+            settled = frontier.pop(plies, [])
+            for index, value in pending.pop(plies, []):
+                if values[index] == DRAW and (value & 1 or children[index] == 0):
+                    values[index] = value
+                    settled.append(index)
+            nextLevel = frontier.setdefault(plies + 1, [])
+            results = pool.imap_unordered(predecessors, settled, chunksize=256) if pool is not None else map(predecessors, settled)
+            for index, previousIndexes in results:
+                if values[index] & 1: # side to move here wins, so the move into it was a losing try
+                    for previous in previousIndexes:
+                        if values[previous] != DRAW or children[previous] == 0:
+                            continue
+                        children[previous] -= 1
+                        if children[previous] == 0 and not exitWin[previous] and not exitDraw[previous]:
+                            lossPlies = max(plies + 1, exitLoss[previous])
+                            if lossPlies == plies + 1:
+                                values[previous] = lossPlies + MATED
+                                nextLevel.append(previous)
+                            else:
+                                pending.setdefault(lossPlies, []).append((previous, lossPlies + MATED))
+                else: # side to move here is mated, the move into it wins
+                    for previous in previousIndexes:
+                        if values[previous] == DRAW and (children[previous] or exitWin[previous] or exitLoss[previous] or exitDraw[previous]):
+                            values[previous] = plies + 1
+                            nextLevel.append(previous)
+            if not nextLevel:
+                del frontier[plies + 1]
+            plies += 1
+            if plies + MATED >= ILLEGAL:
+                raise ValueError("%s has mates longer than a table byte can hold" % material)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, material + ".tb"), "wb") as tableFile:
+        values.tofile(tableFile)
+    return size, time.perf_counter() - startTime
+
+# Material sets a table captures or promotes into
+def subMaterials(material):
+    white, black = splitMaterial(material)
+    found = set()
+    for side, other, isWhite in ((white, black, True), (black, white, False)):
+        for i in range(1, len(side)):
+            reduced = side[:i] + side[i + 1:]
+            found.add(canonicalMaterial(reduced + other if isWhite else other + reduced))
+            if side[i] == "P":
+                for promotion in "QRBN":
+                    promoted = side[:i] + promotion + side[i + 1:]
+                    found.add(canonicalMaterial(promoted + other if isWhite else other + promoted))
+    return found
+
+# Generate material and, first, every smaller table it depends on that isn't in directory yet
+def generateWithDependencies(material, directory=TABLEBASE_DIR, workers=1, log=print, done=None):
+    done = set() if done is None else done
+    material = canonicalMaterial(material)
+    tablebases = Tablebases(directory)
+    if material in done or material in DRAWN_MATERIAL or tablebases.has(material):
+        return
+    for sub in sorted(subMaterials(material)):
+        if sub not in DRAWN_MATERIAL:
+            generateWithDependencies(sub, directory, workers, log, done)
+    size, seconds = generateTable(material, directory, workers, log)
+    done.add(material)
+    if log:
+        tablebases = Tablebases(directory)
+        spec, values = tablebases.loadTable(material)
+        longest = max((value for value in values if value != ILLEGAL and value & 1), default=0)
+        log("%s: %d positions in %.1fs, longest mate %d plies" % (material, size, seconds, longest))
+
+###########################################
+# Command Line
+###########################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="build tables for material sets such as KQK or KRKN")
+    generate.add_argument("materials", nargs="+")
+    generate.add_argument("--workers", type=int, default=1, help="processes used for generation")
+    generate.add_argument("--dir", default=TABLEBASE_DIR, help="directory the tables are written to")
+    probe = commands.add_parser("probe", help="look up a position")
+    probe.add_argument("--fen", required=True)
+    probe.add_argument("--dir", default=TABLEBASE_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for material in args.materials:
+            generateWithDependencies(material, args.dir, args.workers)
+        return 0
+    tablebases = Tablebases(args.dir)
+    gs = ChessEngine.Game(fen=args.fen)
+    entry = tablebases.probe(gs)
+    if entry is None:
+        print("not in the tablebases")
+        return 1
+    result, plies = entry
+    print("draw" if result == 0 else "%s in %d plies" % ("mate" if result > 0 else "mated", plies))
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        child = tablebases.probe(gs)
+        gs.undoMove()
+        if child is not None:
+            childResult, childPlies = child
+            print("  %-8s %s" % (gs.getSAN(move), "draw" if childResult == 0 else
+                                 "%s in %d" % ("mate" if childResult < 0 else "mated", childPlies + 1)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
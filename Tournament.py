@@ -0,0 +1,387 @@
+'''
+Tournament: self-play matches between two engine configurations, to tell whether a change makes the engine
+stronger. Games are played headless with ChessEngine.Game on a pool of worker processes, every opening
+twice with colors reversed, and each finished game is appended to a JSON lines file (and optionally a
+PGN file) as soon as it ends. A sequential probability ratio test stops the match once the result is clear.
+
+python Tournament.py --engine-a "depth=3" --engine-b "depth=2" --games 200 --workers 4
+python Tournament.py --engine-a "DELTA_MARGIN=3" --engine-b "" --tc 10+0.1 --games 2000 --results match.jsonl
+python Tournament.py --engine-a "module=SmartMoveFinderNew" --engine-b "module=SmartMoveFinder" --openings openings.epd
+python Tournament.py --engine-a "depth=2" --engine-b "depth=2" --games 16 --scaling 1,2,4   games per hour by worker count
+
+An engine is a comma separated list of settings: depth (deepest iteration), time (seconds per move when
+there is no --tc), tt (transposition table MB), ordering (0 turns move ordering off), module (search module
+to import instead of SmartMoveFinder, e.g. a copy of the old version) and any UPPERCASE name, which is set
+on the search module while that engine thinks (DELTA_MARGIN=3, TIME_CHECK_NODES=256). Results are from
+engine A's point of view.
+'''
+
+###########################################
+# Imports
+###########################################
+
+import argparse
+import ast
+import importlib
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+import ChessEngine
+import SmartMoveFinder
+from ChessUCI import allotTime
+
+###########################################
+# Settings
+###########################################
+
+GAMES = 100
+RANDOM_OPENING_PLIES = (4, 8) # random openings play between this many random moves from the start position
+MAX_GAME_PLIES = 400 # games still going after this many plies are scored as draws
+MAX_DEPTH = 32 # depth limit of engines that play on a clock
+SPRT_ALPHA = 0.05 # chance of accepting elo1 when elo0 is true
+SPRT_BETA = 0.05 # chance of accepting elo0 when elo1 is true
+SPRT_ELO0 = 0.0
+SPRT_ELO1 = 10.0
+SPRT_MIN_GAMES = 16 # the normal approximation behind the test is too rough to stop on fewer games
+
+###########################################
+# Engines
+###########################################
+
+# Engine settings from "depth=3,time=0.5,DELTA_MARGIN=3", raising ValueError for anything it doesn't know
+def parseEngine(spec):
+    engine = {"name": spec or "default", "depth": None, "time": None, "tt": SmartMoveFinder.TT_SIZE_MB,
+              "ordering": True, "module": "SmartMoveFinder", "overrides": {}}
+    for setting in spec.split(","):
+        if not setting.strip():
+            continue
+        name, separator, text = setting.partition("=")
+        name, text = name.strip(), text.strip()
+        if not separator:
+            raise ValueError("engine setting %s has no value" % setting)
+        try:
+            value = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            value = text
+        if name.isupper():
+            engine["overrides"][name] = value
+        elif name in ("depth", "time", "tt", "ordering", "module"):
+            engine[name] = value
+        else:
+            raise ValueError("unknown engine setting %s" % name)
+    return engine
+
+# One move's search by engine, with its module overrides in place only while it thinks
+def engineMove(engine, searcher, module, gs, validMoves, timeLimit):
+    saved = {name: getattr(module, name) for name in engine["overrides"]}
+    for name, value in engine["overrides"].items():
+        setattr(module, name, value)
+    try:
+        searcher.timeLimit = timeLimit
+        return searcher.search(gs, validMoves).bestMove
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+def makeSearcher(engine, module, timeControl):
+    depth = engine["depth"] or (MAX_DEPTH if timeControl is not None else module.DEPTH)
+    return module.Searcher(depth, engine["time"], engine["tt"], bool(engine["ordering"]))
+
+###########################################
+# Games
+###########################################
+
+# Kings alone, or kings and a single bishop or knight
+def insufficientMaterial(gs):
+    pieces = [piece for piece, squares in gs.pieceSquares.items() for sq in squares if piece[1] != "K"]
+    return not pieces or (len(pieces) == 1 and pieces[0][1] in "BN")
+
+# Why the game is over, or None. Checkmate and stalemate come from validMoves being empty.
+def gameOverReason(gs, validMoves, repetitions, plies):
+    if not validMoves:
+        return "checkmate" if gs.inCheck() else "stalemate"
+    if repetitions.get(gs.zobristKey, 0) >= 3:
+        return "repetition"
+    if gs.halfmoveClock >= 100:
+        return "fifty moves"
+    if insufficientMaterial(gs):
+        return "insufficient material"
+    if plies >= MAX_GAME_PLIES:
+        return "move limit"
+    return None
+
+# Play one game in a worker. task: (game number, opening FEN, opening SAN moves, white engine, black engine,
+# time control (base seconds, increment seconds) or None, whether engine A plays white).
+def playGame(task):
+    number, fen, opening, white, black, timeControl, aIsWhite = task
+    startTime = time.perf_counter()
+    gs = ChessEngine.Game(fen=fen)
+    modules = {True: importlib.import_module(white["module"]), False: importlib.import_module(black["module"])}
+    players = {True: white, False: black}
+    searchers = {side: makeSearcher(players[side], modules[side], timeControl) for side in (True, False)}
+    clocks = {side: timeControl[0] for side in (True, False)} if timeControl is not None else None
+    repetitions = {gs.zobristKey: 1}
+    moves = []
+    reason = None
+    winner = None # True white, False black, None draw
+    while True:
+        validMoves = gs.getValidMoves()
+        reason = gameOverReason(gs, validMoves, repetitions, len(moves))
+        if reason is not None:
+            if reason == "checkmate":
+                winner = not gs.whiteToMove
+            break
+        side = gs.whiteToMove
+        timeLimit = players[side]["time"]
+        if clocks is not None:
+            timeLimit = allotTime(clocks[side] * 1000, timeControl[1] * 1000)
+        moveStart = time.perf_counter()
+        move = engineMove(players[side], searchers[side], modules[side], gs, validMoves, timeLimit)
+        if clocks is not None:
+            clocks[side] -= time.perf_counter() - moveStart
+            if clocks[side] < 0:
+                reason, winner = "time forfeit", not side
+                break
+            clocks[side] += timeControl[1]
+        moves.append(gs.getSAN(move))
+        gs.makeMove(move)
+        repetitions[gs.zobristKey] = repetitions.get(gs.zobristKey, 0) + 1
+    result = "1/2-1/2" if winner is None else ("1-0" if winner else "0-1")
+    scoreA = 0.5 if winner is None else float(winner == aIsWhite)
+    return {"game": number, "white": white["name"], "black": black["name"], "aIsWhite": aIsWhite, "fen": fen,
+            "opening": opening, "result": result, "reason": reason, "scoreA": scoreA, "plies": len(moves),
+            "moves": moves, "seconds": round(time.perf_counter() - startTime, 3)}
+
+# FEN of a FEN or EPD line: the four position fields, plus the counters when the line has them
+def openingFEN(line):
+    fields = line.split(";")[0].split()
+    counters = fields[4:6] if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else ["0", "1"]
+    return " ".join(fields[:4] + counters)
+
+# Opening positions as (FEN, SAN moves): from a file of FEN or EPD lines, or random moves from the start
+def openingPositions(path, count, rng):
+    if path is not None:
+        with open(path) as openingFile:
+            fens = [openingFEN(line) for line in openingFile if line.strip() and not line.startswith("#")]
+        if not fens:
+            raise ValueError("no positions in " + path)
+        return [(fens[i % len(fens)], []) for i in range(count)]
+    openings = []
+    while len(openings) < count:
+        gs = ChessEngine.Game()
+        sans = []
+        for ply in range(rng.randint(*RANDOM_OPENING_PLIES)):
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                break
+            move = rng.choice(validMoves)
+            sans.append(gs.getSAN(move))
+            gs.makeMove(move)
+        if gs.getValidMoves(): # the game has to go on from the opening
+            openings.append((gs.getFEN(), sans))
+    return openings
+
+# Game tasks, every opening twice with engines A and B swapping colors
+def gameTasks(engineA, engineB, openings, games, timeControl):
+    for number in range(games):
+        fen, opening = openings[number // 2]
+        aIsWhite = number % 2 == 0
+        white, black = (engineA, engineB) if aIsWhite else (engineB, engineA)
+        yield (number + 1, fen, opening, white, black, timeControl, aIsWhite)
+
+###########################################
+# Statistics
+###########################################
+
+def expectedScore(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+# Log likelihood ratio of elo1 against elo0 for wins, draws and losses, with the normal approximation to the
+# trinomial distribution of game scores (the generalised SPRT). 0 while there isn't enough to go on.
+def sprtLLR(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    if games == 0 or wins + losses == 0:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:
+        return 0.0
+    score0, score1 = expectedScore(elo0), expectedScore(elo1)
+    return (score1 - score0) * (2 * score - score0 - score1) * games / (2 * variance)
+
+def sprtBounds(alpha=SPRT_ALPHA, beta=SPRT_BETA):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+# Elo difference of A over B from its score, with the 95% interval, (elo, margin)
+def eloEstimate(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    def elo(s):
+        s = min(max(s, 1e-6), 1 - 1e-6)
+        return -400 * math.log10(1 / s - 1)
+    margin = 1.96 * math.sqrt(variance / games)
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+###########################################
+# Tournament
+###########################################
+
+# Play the match, writing every game to resultsFile (and pgnFile) as it finishes and stopping early when the
+# SPRT accepts either hypothesis (sprt is (elo0, elo1), None to play every game). Returns the summary dict.
+def runTournament(engineA, engineB, games, workers, timeControl=None, openingsPath=None, seed=0,
+                  resultsFile=None, pgnFile=None, sprt=(SPRT_ELO0, SPRT_ELO1), progress=None):
+    rng = random.Random(seed)
+    openings = openingPositions(openingsPath, (games + 1) // 2, rng)
+    counts = {"wins": 0, "draws": 0, "losses": 0}
+    reasons = {}
+    lower, upper = sprtBounds()
+    llr = 0.0
+    verdict = None
+    played = 0
+    startTime = time.perf_counter()
+    tasks = gameTasks(engineA, engineB, openings, games, timeControl)
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        results = pool.imap_unordered(playGame, tasks) if pool is not None else map(playGame, tasks)
+        for game in results:
+            played += 1
+            counts["wins" if game["scoreA"] == 1 else "draws" if game["scoreA"] == 0.5 else "losses"] += 1
+            reasons[game["reason"]] = reasons.get(game["reason"], 0) + 1
+            if resultsFile is not None:
+                resultsFile.write(json.dumps(game) + "\n")
+                resultsFile.flush()
+            if pgnFile is not None:
+                writePGN(pgnFile, game)
+            if sprt is not None:
+                llr = sprtLLR(counts["wins"], counts["draws"], counts["losses"], *sprt)
+                if played < SPRT_MIN_GAMES:
+                    pass
+                elif llr >= upper:
+                    verdict = "H1 accepted"
+                elif llr <= lower:
+                    verdict = "H0 accepted"
+            if progress is not None:
+                progress(played, counts, llr, time.perf_counter() - startTime)
+            if verdict is not None:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    elapsed = time.perf_counter() - startTime
+    elo, margin = eloEstimate(counts["wins"], counts["draws"], counts["losses"])
+    gamesPerHour = played / elapsed * 3600 if elapsed > 0 else 0.0
+    return {"name": "total", "engineA": engineA["name"], "engineB": engineB["name"], "games": played,
+            "wins": counts["wins"], "draws": counts["draws"], "losses": counts["losses"],
+            "score": round((counts["wins"] + counts["draws"] / 2) / played, 4) if played else 0.0,
+            "elo": round(elo, 1) + 0.0, "eloMargin": round(margin, 1), "reasons": reasons,
+            "sprt": None if sprt is None else {"elo0": sprt[0], "elo1": sprt[1], "llr": round(llr, 3),
+                                               "lower": round(lower, 3), "upper": round(upper, 3),
+                                               "verdict": verdict or "inconclusive"},
+            "workers": workers, "seconds": round(elapsed, 2), "gamesPerHour": round(gamesPerHour, 1),
+            "gamesPerHourPerWorker": round(gamesPerHour / workers, 1)}
+
+def writePGN(pgnFile, game):
+    pgnFile.write('[Event "Tournament"]\n[Round "%d"]\n[White "%s"]\n[Black "%s"]\n[Result "%s"]\n[Termination "%s"]\n' % (
+        game["game"], game["white"], game["black"], game["result"], game["reason"]))
+    if game["fen"] != ChessEngine.START_FEN:
+        pgnFile.write('[SetUp "1"]\n[FEN "%s"]\n' % game["fen"])
+    tokens = []
+    fields = game["fen"].split()
+    moveNumber, whiteToMove = int(fields[5]), fields[1] == "w"
+    for i, san in enumerate(game["moves"]):
+        if whiteToMove:
+            tokens.append("%d. %s" % (moveNumber, san))
+        else:
+            tokens.append("%d... %s" % (moveNumber, san) if i == 0 else san)
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    pgnFile.write("\n" + " ".join(tokens + [game["result"]]) + "\n\n")
+    pgnFile.flush()
+
+###########################################
+# Command Line
+###########################################
+
+def parseTimeControl(text):
+    if text is None:
+        return None
+    base, separator, increment = text.partition("+")
+    return (float(base), float(increment or 0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Self-play match between two engine configurations")
+    parser.add_argument("--engine-a", default="", help="settings of the engine being tested, e.g. depth=3,DELTA_MARGIN=3")
+    parser.add_argument("--engine-b", default="", help="settings of the engine it plays against")
+    parser.add_argument("--games", type=int, default=GAMES, help="most games to play, an even number keeps colors fair")
+    parser.add_argument("--workers", type=int, default=SmartMoveFinder.WORKERS, help="games played at once")
+    parser.add_argument("--tc", help="time control in seconds, base+increment such as 10+0.1; without it engines use depth/time")
+    parser.add_argument("--openings", help="file of FEN or EPD lines to start from, random openings when left out")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random openings")
+    parser.add_argument("--results", help="append every game to this JSON lines file")
+    parser.add_argument("--pgn", help="append every game to this PGN file")
+    parser.add_argument("--elo0", type=float, default=SPRT_ELO0, help="SPRT null hypothesis, A is this much stronger")
+    parser.add_argument("--elo1", type=float, default=SPRT_ELO1, help="SPRT alternative hypothesis")
+    parser.add_argument("--no-sprt", action="store_true", help="play every game instead of stopping early")
+    parser.add_argument("--scaling", help="comma separated worker counts: play --games at each and compare games per hour")
+    parser.add_argument("--json", action="store_true", help="machine readable output, one JSON object per line")
+    args = parser.parse_args(argv)
+
+    try:
+        engineA, engineB = parseEngine(args.engine_a), parseEngine(args.engine_b)
+    except ValueError as error:
+        parser.error(str(error))
+    if engineA["name"] == engineB["name"]:
+        engineA["name"], engineB["name"] = "A: " + engineA["name"], "B: " + engineB["name"]
+    timeControl = parseTimeControl(args.tc)
+
+    if args.scaling:
+        baseline = None
+        for workers in [int(count) for count in args.scaling.split(",")]:
+            summary = runTournament(engineA, engineB, args.games, workers, timeControl, args.openings, args.seed, sprt=None)
+            baseline = baseline or summary["gamesPerHour"] / workers
+            summary["scaling"] = round(summary["gamesPerHour"] / baseline, 2) if baseline else 0.0
+            if args.json:
+                print(json.dumps(summary), flush=True)
+            else:
+                print("%2d workers  %7.1f games/hour  %7.1f per worker  speedup %.2fx" % (workers, summary["gamesPerHour"],
+                      summary["gamesPerHourPerWorker"], summary["scaling"]), flush=True)
+        return 0
+
+    def progress(played, counts, llr, elapsed):
+        if not args.json and (played % 10 == 0 or played == args.games):
+            print("%d games  +%d =%d -%d  llr %.2f  %.0f games/hour" % (played, counts["wins"], counts["draws"], counts["losses"],
+                  llr, played / elapsed * 3600 if elapsed > 0 else 0), file=sys.stderr, flush=True)
+
+    resultsFile = open(args.results, "a") if args.results else None
+    pgnFile = open(args.pgn, "a") if args.pgn else None
+    try:
+        summary = runTournament(engineA, engineB, args.games, args.workers, timeControl, args.openings, args.seed,
+                                resultsFile, pgnFile, None if args.no_sprt else (args.elo0, args.elo1), progress)
+    finally:
+        for openFile in (resultsFile, pgnFile):
+            if openFile is not None:
+                openFile.close()
+    if args.json:
+        print(json.dumps(summary))
+        return 0
+    print("%s vs %s: %d games, +%d =%d -%d, score %.1f%%, elo %+.1f +/- %.1f" % (summary["engineA"], summary["engineB"],
+          summary["games"], summary["wins"], summary["draws"], summary["losses"], 100 * summary["score"], summary["elo"],
+          summary["eloMargin"]))
+    if summary["sprt"] is not None:
+        sprt = summary["sprt"]
+        print("sprt elo0 %g elo1 %g: llr %.2f (%.2f, %.2f), %s" % (sprt["elo0"], sprt["elo1"], sprt["llr"], sprt["lower"],
+              sprt["upper"], sprt["verdict"]))
+    print("endings: " + ", ".join("%s %d" % (reason, count) for reason, count in sorted(summary["reasons"].items())))
+    print("%.1fs, %.1f games/hour, %.1f games/hour per worker (%d workers)" % (summary["seconds"], summary["gamesPerHour"],
+          summary["gamesPerHourPerWorker"], summary["workers"]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())